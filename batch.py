@@ -0,0 +1,346 @@
+"""Headless batch background removal and upscaling.
+
+Example:
+    python batch.py photos/ "scans/*.jpg" -o out --alpha-matting --upscale 2 --format webp --webp-lossless
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image, ImageColor
+
+import profiling
+from disk_cache import DiskCache, format_bytes
+from export import FORMATS as OUTPUT_FORMATS, JPEG_SUBSAMPLING, PRESETS as EXPORT_PRESETS, encoder_options, \
+    output_paths, save_image
+from pipeline import remove_backgrounds
+from profiles import DEFAULT_PROFILE, PROFILES
+from sessions import DEFAULT_MODEL
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+# Per-process state, set up once by _init_worker
+_worker = {}
+
+
+class StageTimer:
+    """Accumulates wall time per stage from a stream of progress(stage, fraction) reports."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.timings = {}
+        self._stage = None
+        self._started = None
+
+    def report(self, stage, fraction=0.0):
+        if stage != self._stage:
+            self.stop()
+            self._stage = stage
+            self._started = time.perf_counter()
+
+    def stop(self):
+        if self._stage is not None:
+            name = self.prefix + self._stage
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - self._started
+            self._stage = None
+
+
+def collect_inputs(patterns):
+    """Expand directories and glob patterns into a sorted list of image files."""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in os.listdir(pattern):
+                paths.add(os.path.join(pattern, name))
+        else:
+            paths.update(glob.glob(pattern, recursive=True))
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def is_up_to_date(input_path, output_path):
+    """An output is up to date when it exists and is newer than its input."""
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def apply_background_color(image, color):
+    """Composite an RGBA image over a solid color."""
+    colored_bg = Image.new("RGBA", image.size, color)
+    return Image.alpha_composite(colored_bg, image)
+
+
+def _init_worker(options, threads):
+    """Load the models once per worker process and size its thread pools."""
+    from profiles import new_session
+    from sessions import RembgSessionManager
+    from upscaler import EdsrModelRegistry
+
+    if options["upscale"] > 1:
+        # Importing torch takes seconds and a lot of memory, so remove-only runs skip it
+        import torch
+
+        # Several workers share the machine, so keep each one from grabbing every core
+        torch.set_num_threads(threads)
+
+    if options["trace"]:
+        profiling.enable()
+
+    _worker["options"] = options
+    _worker["sessions"] = RembgSessionManager(
+        session_factory=lambda model_name: new_session(model_name, options["profile"], threads))
+    _worker["models"] = EdsrModelRegistry(weights_dir=options.get("weights_dir"), profile=options["profile"],
+                                          threads=threads)
+    _worker["cache"] = DiskCache(options["cache_dir"]) if options["cache"] else None
+
+    # Warm everything up front so the first image is not slower than the rest
+    if options["remove"]:
+        _worker["sessions"].get(options["model"])
+    if options["upscale"] > 1:
+        _worker["models"].get(options["upscale"])
+
+
+def _finish(image, output_path, timings):
+    """Upscale, composite and save one image in a worker."""
+    from upscaler import upscale
+
+    options = _worker["options"]
+
+    if options["upscale"] > 1:
+        timer = StageTimer("upscale:")
+        # After removal most of the frame is usually transparent and needs no super-resolution
+        image = upscale(image, _worker["models"].get(options["upscale"]), progress=timer.report,
+                        disk_cache=_worker["cache"], skip_transparent=options["remove"])
+        timer.stop()
+        timings.update(timer.timings)
+
+    started = time.perf_counter()
+    if options["background_color"]:
+        image = apply_background_color(image, options["background_color"])
+    timings["compositing"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Written next to the final name and renamed, so an interrupted run never leaves a
+    # truncated file that later looks up to date
+    save_image(image, output_path, options["format"], options["encoder"])
+    timings["save"] = time.perf_counter() - started
+
+
+def _process(pairs):
+    """Process a group of images in a worker and write them to disk.
+
+    The group is segmented together, then each image is finished on its own. Returns
+    (output path, stage timings, error) per image, the cache counters for the group and,
+    when tracing, the profiling events recorded meanwhile.
+    """
+    options = _worker["options"]
+    cache = _worker["cache"]
+    cache_before = cache.stats() if cache else None
+
+    results = {}
+    loaded = []
+    for input_path, output_path in pairs:
+        started = time.perf_counter()
+        try:
+            with profiling.stage("decode", path=input_path):
+                image = Image.open(input_path).convert("RGBA")
+        except Exception as e:
+            results[output_path] = ({}, str(e))
+            continue
+        loaded.append((image, output_path, {"load": time.perf_counter() - started}))
+
+    if options["remove"] and loaded:
+        timer = StageTimer("remove:")
+        try:
+            images = remove_backgrounds(
+                [image for image, _, _ in loaded],
+                _worker["sessions"].get(options["model"]),
+                alpha_matting=options["alpha_matting"],
+                foreground_threshold=options["foreground_threshold"],
+                background_threshold=options["background_threshold"],
+                erode_size=options["erode_size"],
+                batch_size=options["segment_batch"],
+                disk_cache=cache,
+                progress=timer.report
+            )
+        except Exception as e:
+            for _, output_path, timings in loaded:
+                results[output_path] = (timings, str(e))
+            loaded = []
+        else:
+            timer.stop()
+            # The group shares one network call, so each image is charged an equal part
+            for (_, output_path, timings), image in zip(loaded, images):
+                timings.update({stage: seconds / len(images) for stage, seconds in timer.timings.items()})
+            loaded = [(image, output_path, timings) for image, (_, output_path, timings) in zip(images, loaded)]
+
+    for image, output_path, timings in loaded:
+        try:
+            _finish(image, output_path, timings)
+        except Exception as e:
+            results[output_path] = (timings, str(e))
+        else:
+            results[output_path] = (timings, None)
+
+    cache_delta = {}
+    if cache:
+        cache_after = cache.stats()
+        cache_delta = {name: cache_after[name] - cache_before[name] for name in ("hits", "misses", "bytes_saved")}
+    events = profiling.get_profiler().drain() if profiling.enabled() else []
+    return [(output_path, timings, error) for output_path, (timings, error) in results.items()], cache_delta, events
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Remove backgrounds and upscale images without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", default="processed", help="where to write results")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="rembg segmentation model")
+    parser.add_argument("--no-remove", action="store_true", help="skip background removal")
+    parser.add_argument("--alpha-matting", action="store_true", help="refine edges with alpha matting")
+    parser.add_argument("--foreground-threshold", type=int, default=240)
+    parser.add_argument("--background-threshold", type=int, default=10)
+    parser.add_argument("--erode-size", type=int, default=10)
+    parser.add_argument("--segment-batch", type=int, default=4,
+                        help="images segmented per network call, capped by available memory")
+    parser.add_argument("--background-color", help="solid background color, e.g. '#ffffff' or 'white'")
+    parser.add_argument("--upscale", type=int, choices=(1, 2, 3, 4), default=1, help="super-resolution factor")
+    parser.add_argument("--weights-dir", help="local EDSR weights, for machines without network access")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="inference profile: float32 quality, thread-tuned balanced or int8 fast")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="png", help="output format")
+    parser.add_argument("--export-preset", choices=list(EXPORT_PRESETS), default="default",
+                        help="encoder settings: Pillow's defaults, fast, smallest or best; the options below "
+                             "override single settings")
+    parser.add_argument("--png-compress-level", type=int, choices=range(10), metavar="0-9",
+                        help="zlib level, 1 is fastest and 9 smallest")
+    parser.add_argument("--png-optimize", action="store_true", default=None,
+                        help="search for the smallest PNG encoding, much slower")
+    parser.add_argument("--jpeg-quality", type=int, metavar="1-95")
+    parser.add_argument("--jpeg-subsampling", choices=JPEG_SUBSAMPLING,
+                        help="chroma subsampling, 4:4:4 keeps colored edges sharp")
+    parser.add_argument("--webp-lossless", action="store_true", default=None)
+    parser.add_argument("--webp-quality", type=int, metavar="0-100",
+                        help="lossy quality, or compression effort when lossless")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--force", action="store_true", help="reprocess images whose output is up to date")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the result cache")
+    parser.add_argument("--cache-dir", help="result cache directory (default: $BGXUP_CACHE_DIR or ~/.cache/bgxup)")
+    parser.add_argument("--trace", help="write per-stage timings and memory to a Chrome trace (.json) or a "
+                                        "JSON log (.jsonl)")
+    return parser.parse_args(argv)
+
+
+def print_summary(processed, skipped, failed, elapsed, stage_totals, cache_totals):
+    print()
+    print(f"Processed {processed} image(s), skipped {skipped} up to date, {failed} failed in {elapsed:.2f}s")
+    if processed and elapsed > 0:
+        print(f"Throughput: {processed / elapsed:.2f} images/s")
+    if stage_totals:
+        print("Per-stage time (summed over workers, mean per image):")
+        width = max(len(stage) for stage in stage_totals)
+        for stage, total in sorted(stage_totals.items(), key=lambda item: -item[1]):
+            print(f"  {stage:<{width}}  {total:8.2f}s  {total / processed * 1000:8.1f} ms")
+    lookups = cache_totals.get("hits", 0) + cache_totals.get("misses", 0)
+    if lookups:
+        print(f"Cache: {cache_totals['hits']}/{lookups} hits ({cache_totals['hits'] / lookups:.0%}), "
+              f"{format_bytes(cache_totals['bytes_saved'])} read instead of recomputed")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("No images found.", file=sys.stderr)
+        return 1
+
+    overrides = {
+        "png": {"compress_level": args.png_compress_level, "optimize": args.png_optimize},
+        "jpg": {"quality": args.jpeg_quality, "subsampling": args.jpeg_subsampling},
+        "webp": {"lossless": args.webp_lossless, "quality": args.webp_quality},
+    }
+    options = {
+        "remove": not args.no_remove,
+        "model": args.model,
+        "alpha_matting": args.alpha_matting,
+        "foreground_threshold": args.foreground_threshold,
+        "background_threshold": args.background_threshold,
+        "erode_size": args.erode_size,
+        "background_color": ImageColor.getrgb(args.background_color) if args.background_color else None,
+        "upscale": args.upscale,
+        "weights_dir": args.weights_dir,
+        "profile": args.profile,
+        "segment_batch": max(1, args.segment_batch),
+        "format": args.format,
+        "encoder": encoder_options(args.format, args.export_preset, **overrides[args.format]),
+        "cache": not args.no_cache,
+        "cache_dir": args.cache_dir,
+        "trace": bool(args.trace),
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs, conflicts = output_paths(inputs, args.output_dir, args.format)
+    conflicted = sum(len(input_paths) for _, input_paths in conflicts)
+    for output_path, input_paths in conflicts:
+        print(f"FAILED {output_path}: {', '.join(input_paths)} would all be written here", file=sys.stderr)
+
+    jobs = []
+    skipped = 0
+    for input_path, output_path in outputs.items():
+        if not args.force and is_up_to_date(input_path, output_path):
+            skipped += 1
+        else:
+            jobs.append((input_path, output_path))
+
+    workers = max(1, min(args.workers, len(jobs)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"{len(jobs)} image(s) to process, {skipped} up to date, {workers} worker(s) x {threads} thread(s)")
+
+    processed = 0
+    failed = 0
+    stage_totals = {}
+    cache_totals = {}
+    trace = profiling.Profiler() if args.trace else None
+    started = time.perf_counter()
+    if jobs:
+        # Spawn rather than fork: torch, onnxruntime and numba thread pools do not survive a fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(options, threads)) as executor:
+            # Images are handed out in groups so each worker can segment a group in one call
+            group_size = options["segment_batch"] if options["remove"] else 1
+            groups = [jobs[start:start + group_size] for start in range(0, len(jobs), group_size)]
+            futures = {executor.submit(_process, group): group for group in groups}
+            for future in as_completed(futures):
+                try:
+                    results, cache_delta, events = future.result()
+                except Exception as e:
+                    results = [(output_path, {}, str(e)) for _, output_path in futures[future]]
+                    cache_delta, events = {}, []
+                if trace:
+                    trace.add_events(events)
+                for name, value in cache_delta.items():
+                    cache_totals[name] = cache_totals.get(name, 0) + value
+
+                for output_path, timings, error in results:
+                    if error:
+                        failed += 1
+                        print(f"FAILED {output_path}: {error}", file=sys.stderr)
+                        continue
+                    processed += 1
+                    for stage, seconds in timings.items():
+                        stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+                    print(f"[{processed + failed}/{len(jobs)}] {output_path} ({sum(timings.values()):.2f}s)")
+
+    # Conflicting inputs are reported as failures, but were never part of the progress count
+    failed += conflicted
+    print_summary(processed, skipped, failed, time.perf_counter() - started, stage_totals, cache_totals)
+    if trace:
+        trace.save(args.trace)
+        print(f"Trace written to {args.trace}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
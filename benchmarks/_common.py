@@ -0,0 +1,32 @@
+"""Synthetic test images and timing shared by the benchmarks and `profiles.py check`."""
+import time
+
+
+def synthetic_image(width, height, transparent=False, seed=0):
+    """A noisy background with a bright ellipse in the middle, or the ellipse alone on transparency as a cut-out.
+
+    Returns an RGB image, or RGBA when transparent. A seed and size always give the same image.
+    """
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    pixels = (rng.random((height, width, 3)) * 96).astype(np.uint8)
+    y, x = np.ogrid[:height, :width]
+    inside = ((x - width / 2) / (width / 3)) ** 2 + ((y - height / 2) / (height / 3)) ** 2 <= 1
+    pixels[inside] = (230, 200, 160)
+    image = Image.fromarray(pixels, "RGB")
+    if transparent:
+        image.putalpha(Image.fromarray(np.where(inside, 255, 0).astype(np.uint8), "L"))
+    return image
+
+
+def timed(fn, repeat=1):
+    """Call fn repeat times and return the fastest run's seconds and the last result."""
+    best = result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
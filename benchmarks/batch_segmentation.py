@@ -0,0 +1,60 @@
+"""Compares segmentation throughput one image at a time against batched inference.
+
+Run from the project root:
+    python benchmarks/batch_segmentation.py --model u2net --images 32 --batch-sizes 1,4,8,16
+
+The one-at-a-time path is session.predict, as rembg.remove uses it. The batched path
+is pipeline.segment_batch, which also checks that it produces the same masks.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import segment_batch, segmentation_batch_size  # noqa: E402
+from sessions import new_session  # noqa: E402
+
+from _common import synthetic_image, timed  # noqa: E402
+
+
+def synthetic_images(count, width, height):
+    """Synthetic test images at slightly varying sizes."""
+    return [synthetic_image(width + 16 * (index % 4), height - 16 * (index % 3), seed=index)
+            for index in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="u2net", help="rembg segmentation model")
+    parser.add_argument("--images", type=int, default=32, help="number of synthetic images")
+    parser.add_argument("--size", default="640x480", help="image size, WIDTHxHEIGHT")
+    parser.add_argument("--batch-sizes", default="1,4,8,16", help="comma separated batch sizes to try")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration, the fastest is kept")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    images = synthetic_images(args.images, width, height)
+    session = new_session(args.model)
+    # Warm up, so neither path pays for ONNX Runtime's first-run allocations
+    session.predict(images[0])
+
+    baseline, reference = timed(lambda: [session.predict(image) for image in images], args.repeat)
+    print(f"{args.model}, {len(images)} images of about {args.size}")
+    print(f"  one at a time      {len(images) / baseline:8.2f} images/s")
+
+    auto = segmentation_batch_size(args.model)
+    for batch_size in sorted({int(v) for v in args.batch_sizes.split(",")} | {auto}):
+        elapsed, results = timed(lambda: segment_batch(images, session, batch_size=batch_size), args.repeat)
+        difference = max(
+            int(np.abs(np.asarray(masks[0], dtype=np.int16) - np.asarray(expected[0], dtype=np.int16)).max())
+            for (_, masks), expected in zip(results, reference))
+        label = f"batch {batch_size}" + (" (auto)" if batch_size == auto else "")
+        print(f"  {label:<18} {len(images) / elapsed:8.2f} images/s  {baseline / elapsed:5.2f}x  "
+              f"max mask difference {difference}")
+
+
+if __name__ == "__main__":
+    main()
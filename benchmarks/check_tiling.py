@@ -0,0 +1,60 @@
+"""Checks that tiled upscaling matches a single pass of the model on small images.
+
+Run from the project root:
+    python benchmarks/check_tiling.py
+
+Uses the EDSR weights from BGXUP_WEIGHTS_DIR when available and a randomly
+initialised EDSR otherwise, since seam correctness does not depend on the weights.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from super_image import EdsrConfig, EdsrModel  # noqa: E402
+
+from upscaler import DEFAULT_BLEND, DEFAULT_OVERLAP, EdsrModelRegistry, upscale_array  # noqa: E402
+
+
+def load_model(scale):
+    registry = EdsrModelRegistry()
+    if registry.weights_dir and registry.resolve_source(scale) != registry.model_id:
+        return registry.get(scale)
+    torch.manual_seed(0)
+    return EdsrModel(EdsrConfig(scale=scale)).eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP)
+    parser.add_argument("--blend", type=int, default=DEFAULT_BLEND)
+    parser.add_argument("--tolerance", type=int, default=1,
+                        help="largest allowed per-channel difference from the single pass")
+    args = parser.parse_args()
+
+    model = load_model(args.scale)
+    rng = np.random.default_rng(0)
+
+    failures = 0
+    # Odd sizes make sure partial tiles at the right and bottom edges are covered
+    for height, width, tile_size in [(64, 64, 32), (97, 131, 32), (75, 40, 48), (120, 90, 17)]:
+        image = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+        reference = upscale_array(image, model, tile_size=max(height, width))
+        tiled = upscale_array(image, model, tile_size=tile_size, overlap=args.overlap, blend=args.blend)
+
+        difference = np.abs(tiled.astype(np.int16) - reference.astype(np.int16))
+        ok = difference.max() <= args.tolerance
+        failures += not ok
+        print(f"{width}x{height} tile {tile_size}: max diff {difference.max()}, "
+              f"mean diff {difference.mean():.5f} {'OK' if ok else 'FAIL'}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
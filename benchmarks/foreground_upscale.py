@@ -0,0 +1,71 @@
+"""Compares full-frame upscaling with skipping fully transparent tiles.
+
+Run from the project root:
+    python benchmarks/foreground_upscale.py --size 1024x768 --coverage 0.3
+
+The subject is an opaque ellipse covering about --coverage of a transparent frame.
+Checks that every pixel with alpha > 0 is identical in both results and exits 1 if not.
+Uses the EDSR weights from BGXUP_WEIGHTS_DIR when available and a randomly initialised
+EDSR otherwise, since the run time and the comparison do not depend on the weights.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import timed  # noqa: E402
+from check_tiling import load_model  # noqa: E402
+
+from upscaler import FOREGROUND_TILE_SIZE, upscale  # noqa: E402
+
+
+def product_shot(width, height, coverage):
+    """A noisy subject on a transparent background, the way background removal leaves it."""
+    rng = np.random.default_rng(0)
+    pixels = (rng.random((height, width, 4)) * 255).astype(np.uint8)
+    # An ellipse with semi-axes a and b covers pi * a * b of the frame
+    radius = (coverage * width * height / np.pi) ** 0.5
+    y, x = np.ogrid[:height, :width]
+    inside = ((x - width / 2) / (radius * width / height)) ** 2 + ((y - height / 2) / (radius * height / width)) ** 2
+    pixels[..., 3] = np.where(inside <= 1, 255, 0)
+    pixels[inside > 1, :3] = 0
+    return Image.fromarray(pixels, "RGBA")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1024x768", help="image size, WIDTHxHEIGHT")
+    parser.add_argument("--coverage", type=float, default=0.3, help="fraction of the frame covered by the subject")
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--tile-size", type=int, default=FOREGROUND_TILE_SIZE)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    image = product_shot(width, height, args.coverage)
+    model = load_model(args.scale)
+
+    # Warm up, so neither run pays for the first call into torch
+    upscale(image.resize((64, 64)), model)
+
+    full_time, full = timed(lambda: upscale(image, model, tile_size=args.tile_size))
+    skip_time, skipped = timed(lambda: upscale(image, model, tile_size=args.tile_size, skip_transparent=True))
+
+    full_array = np.asarray(full)
+    skipped_array = np.asarray(skipped)
+    visible = full_array[..., 3] > 0
+    difference = np.abs(full_array.astype(np.int16) - skipped_array.astype(np.int16))[visible].max(initial=0)
+    alpha_equal = np.array_equal(full_array[..., 3], skipped_array[..., 3])
+
+    print(f"{width}x{height}, {visible.mean():.0%} of the output visible, tile {args.tile_size}")
+    print(f"  full frame           {full_time:8.2f}s")
+    print(f"  skip transparent     {skip_time:8.2f}s  {full_time / skip_time:5.2f}x")
+    print(f"  max difference where alpha > 0: {difference}, alpha identical: {alpha_equal}")
+    sys.exit(0 if difference == 0 and alpha_equal else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compares the eager full decode with the lazy preview-first loading of a large image.
+
+Run from the project root:
+    python benchmarks/large_image_load.py --size 12000x8000        # about 100 MP
+    python benchmarks/large_image_load.py --image scan.jpg
+
+Each path runs in a fresh interpreter and reports, per stage, the time taken and the
+resident memory afterwards. "first frame" is when the app has something to show.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from disk_cache import format_bytes  # noqa: E402
+from image_io import LazyImage, memory_usage, peak_memory_usage  # noqa: E402
+
+# Large scans trip Pillow's decompression bomb check, which the app does not change either
+Image.MAX_IMAGE_PIXELS = None
+
+
+def write_test_image(path, width, height):
+    """A smooth gradient with some noise, which compresses like a photo rather than like noise."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    rows = []
+    for start in range(0, height, 1024):
+        count = min(1024, height - start)
+        y = np.linspace(start, start + count, count, dtype=np.float32)[:, None] * 255 / height
+        block = np.stack([np.broadcast_to(x, (count, width)), np.broadcast_to(y, (count, width)),
+                          np.full((count, width), 128, np.float32)], axis=-1)
+        rows.append(np.clip(block + rng.normal(0, 8, block.shape), 0, 255).astype(np.uint8))
+    Image.fromarray(np.concatenate(rows)).save(path, quality=90)
+
+
+def run_path(path, image_path):
+    """Load the image the way one path does and return [(stage, seconds, rss bytes)]."""
+    stages = []
+    started = time.perf_counter()
+
+    def mark(stage):
+        stages.append((stage, time.perf_counter() - started, memory_usage()))
+
+    mark("start")
+    if path == "eager":
+        # What browse_image used to do before showing anything
+        image = Image.open(image_path).convert("RGBA")
+        mark("full decode")
+        # The copy it displayed; it is freed again at once, but still counts towards the peak
+        image.copy()
+        mark("first frame (after copy)")
+    else:
+        image = LazyImage(image_path)
+        mark("open header")
+        image.preview()
+        mark("first frame (preview)")
+        image.load()
+        mark("full decode (when processing starts)")
+    # resource is Unix-only; image_io falls back to psutil on Windows
+    peak = peak_memory_usage()
+    return {"stages": stages, "peak": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", help="existing image to load instead of a generated JPEG")
+    parser.add_argument("--size", default="12000x8000", help="size of the generated JPEG, WIDTHxHEIGHT")
+    parser.add_argument("--child", choices=("eager", "lazy"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_path(args.child, args.image)))
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = args.image
+        if not image_path:
+            width, height = (int(v) for v in args.size.lower().split("x"))
+            image_path = os.path.join(temp_dir, "large.jpg")
+            print(f"Writing a {width}x{height} test JPEG...")
+            write_test_image(image_path, width, height)
+
+        for path in ("eager", "lazy"):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", path, "--image", image_path],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output)
+            print(f"{path}:")
+            for stage, seconds, rss in result["stages"]:
+                print(f"  {stage:<38} {seconds * 1000:9.1f} ms  {format_bytes(rss) if rss else '?':>10}")
+            peak = format_bytes(result["peak"]) if result["peak"] else "?"
+            print(f"  {'peak resident memory':<38} {'':>12}  {peak:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Drives a running server.py with synthetic images from concurrent clients.
+
+Run from the project root, with the server started first:
+    python server.py --port 8765
+    python benchmarks/load_test.py --url http://127.0.0.1:8765 --endpoint remove --concurrency 8 --requests 200
+
+Reports throughput, client-side latency percentiles and how many requests were
+turned away with 503, followed by the server's own /metrics for the endpoint.
+"""
+import argparse
+import io
+import json
+import math
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from _common import synthetic_image
+
+
+def synthetic_png(width, height, seed):
+    output = io.BytesIO()
+    synthetic_image(width, height, seed=seed).save(output, "PNG")
+    return output.getvalue()
+
+
+def percentile(sorted_values, point):
+    return sorted_values[max(0, math.ceil(point / 100 * len(sorted_values)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8765", help="server address")
+    parser.add_argument("--endpoint", choices=("remove", "upscale"), default="remove")
+    parser.add_argument("--query", default="", help="extra query string, e.g. 'alpha_matting=1' or 'scale=4'")
+    parser.add_argument("--concurrency", type=int, default=8, help="clients sending at the same time")
+    parser.add_argument("--requests", type=int, default=200, help="total requests to send")
+    parser.add_argument("--size", default="640x480", help="image size, WIDTHxHEIGHT")
+    parser.add_argument("--variants", type=int, default=16,
+                        help="distinct images to cycle through; repeats may be answered from the result cache")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    # Vary the seed across runs too, so the server's result cache does not answer everything
+    seed = int(time.time())
+    bodies = [synthetic_png(width, height, seed + index) for index in range(args.variants)]
+    url = f"{args.url.rstrip('/')}/{args.endpoint}" + (f"?{args.query}" if args.query else "")
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            request = urllib.request.Request(url, data=bodies[index % len(bodies)],
+                                             headers={"Content-Type": "application/octet-stream"})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except urllib.error.URLError as e:
+                status = f"error: {e.reason}"
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(max(1, args.concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.requests} {args.endpoint} requests of {args.size} from {args.concurrency} clients "
+          f"in {elapsed:.2f}s")
+    print(f"  throughput    {len(latencies) / elapsed:8.2f} images/s")
+    print(f"  responses     {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items(), key=str))}")
+    if latencies:
+        latencies.sort()
+        print("  latency       " + "  ".join(f"p{point} {percentile(latencies, point) * 1000:.1f} ms"
+                                          for point in (50, 95, 99)))
+
+    try:
+        with urllib.request.urlopen(f"{args.url.rstrip('/')}/metrics") as response:
+            metrics = json.load(response)
+        print("Server metrics:")
+        print(json.dumps(metrics["endpoints"][args.endpoint], indent=2))
+    except (urllib.error.URLError, KeyError, ValueError) as e:
+        print(f"Could not read server metrics: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measures how tiled upscaling scales with the number of tile workers.
+
+Run from the project root:
+    python benchmarks/parallel_tiles.py --size 1024x768 --workers 1,2,4,8,16
+
+Every worker count upscales the same image with the same tiles, so the results must be
+identical; exits 1 if any differs from the single-worker result. Uses the EDSR weights
+from BGXUP_WEIGHTS_DIR when available and a randomly initialised EDSR otherwise, since
+the run time does not depend on the weights.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import timed  # noqa: E402
+from check_tiling import load_model  # noqa: E402
+
+from upscaler import _tile_threads, upscale_array  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1024x768", help="image size, WIDTHxHEIGHT")
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--tile-size", type=int, default=128,
+                        help="tile size, small enough to give every worker several tiles")
+    parser.add_argument("--workers", default="1,2,4,8,16", help="comma separated worker counts to try")
+    parser.add_argument("--repeat", type=int, default=2, help="runs per worker count, the fastest is kept")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    image = (np.random.default_rng(0).random((height, width, 3)) * 255).astype(np.uint8)
+    model = load_model(args.scale)
+    # Warm up, so the first configuration does not pay for the first call into torch
+    upscale_array(image[:64, :64], model)
+
+    print(f"{width}x{height}, {args.scale}x, tile {args.tile_size}, {os.cpu_count()} logical core(s)")
+    baseline = reference = None
+    failures = 0
+    for workers in sorted({int(v) for v in args.workers.split(",")}):
+        elapsed, result = timed(lambda: upscale_array(image, model, tile_size=args.tile_size, workers=workers),
+                                args.repeat)
+        if reference is None:
+            baseline, reference = elapsed, result
+        identical = np.array_equal(result, reference)
+        failures += not identical
+        print(f"  {workers:>2} worker(s) x {_tile_threads(workers):>2} thread(s)  {elapsed:8.2f}s  "
+              f"{baseline / elapsed:5.2f}x  {'identical' if identical else 'DIFFERENT'}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
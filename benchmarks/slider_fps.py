@@ -0,0 +1,103 @@
+"""Measures how fast the before/after slider redraws during a simulated drag.
+
+Run from the project root (needs a display):
+    python benchmarks/slider_fps.py --size 1600x1200
+
+Reports two numbers: the raw redraw rate with every event rendered immediately,
+and the frames actually drawn while drag events arrive at --event-rate per second.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BGXUP_PRELOAD", "0")
+
+import customtkinter  # noqa: E402
+
+from removebg import BeforeAfterSliderFrame  # noqa: E402
+
+
+class DragEvent:
+    def __init__(self, x):
+        self.x = x
+        self.y = 0
+
+
+def synthetic_images(width, height):
+    rng = np.random.default_rng(0)
+    original = Image.fromarray((rng.random((height, width, 4)) * 255).astype(np.uint8), "RGBA")
+    processed = original.copy()
+    processed.putalpha(Image.linear_gradient("L").resize((width, height)))
+    return original, processed
+
+
+def drag_positions(frame, steps):
+    """Sweep back and forth across the displayed image."""
+    left = (frame.width - frame.resized_image1_pil.width) / 2
+    right = left + frame.resized_image1_pil.width
+    sweep = np.concatenate([np.linspace(left, right, steps // 2), np.linspace(right, left, steps - steps // 2)])
+    return [int(x) for x in sweep]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1600x1200", help="source image size, WIDTHxHEIGHT")
+    parser.add_argument("--canvas", default="800x600", help="slider size, WIDTHxHEIGHT")
+    parser.add_argument("--events", type=int, default=600, help="drag events to simulate")
+    parser.add_argument("--event-rate", type=float, default=240.0, help="drag events per second")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    canvas_width, canvas_height = (int(v) for v in args.canvas.lower().split("x"))
+
+    root = customtkinter.CTk()
+    frame = BeforeAfterSliderFrame(root, width=canvas_width, height=canvas_height)
+    frame.pack(fill="both", expand=True)
+    root.update()
+
+    original, processed = synthetic_images(width, height)
+    frame.show_images(original, processed)
+    root.update()
+    positions = drag_positions(frame, args.events)
+
+    # Unthrottled: render every event straight away
+    started = time.perf_counter()
+    for x in positions:
+        frame._on_drag(DragEvent(x))
+        frame._redraw_images()
+        root.update_idletasks()
+    elapsed = time.perf_counter() - started
+    print(f"Raw redraw rate:      {len(positions) / elapsed:8.1f} frames/s ({elapsed / len(positions) * 1000:.2f} ms/frame)")
+
+    # Throttled: events arrive at a fixed rate and the frame batches them
+    redraws = 0
+    redraw = frame._redraw_images
+
+    def counting_redraw():
+        nonlocal redraws
+        redraws += 1
+        redraw()
+
+    frame._redraw_images = counting_redraw
+    interval = 1.0 / args.event_rate
+    started = time.perf_counter()
+    for index, x in enumerate(positions):
+        frame._on_drag(DragEvent(x))
+        while time.perf_counter() < started + (index + 1) * interval:
+            root.update()
+    root.update()
+    elapsed = time.perf_counter() - started
+    print(f"Simulated drag:       {redraws / elapsed:8.1f} frames/s drawn for {args.event_rate:.0f} events/s "
+          f"over {elapsed:.2f}s")
+
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Measures application startup time and the memory each inference subsystem adds.
+
+Run from the project root:
+    python benchmarks/startup.py            # subsystems and time to first frame
+    python benchmarks/startup.py --no-gui   # subsystems only, for machines without a display
+
+Every measurement runs in a fresh interpreter so earlier imports do not hide the cost.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported in this order, so each entry only pays for what the previous ones did not load
+SUBSYSTEMS = ("onnxruntime", "rembg.bg", "torch", "super_image")
+
+CHILD_PRELUDE = r'''
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, PROJECT_ROOT)
+
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+'''
+
+CHILD_GUI = r'''
+rss_before = rss_mb()
+import removebg
+imported = time.perf_counter()
+app = removebg.AdvancedBackgroundRemoverApp()
+app.update_idletasks()
+app.update()
+first_frame = time.perf_counter()
+result = {
+    "import_s": imported - started,
+    "first_frame_s": first_frame - started,
+    "rss_before_mb": rss_before,
+    "rss_first_frame_mb": rss_mb(),
+    "inference_modules_loaded": sorted(name for name in removebg.INFERENCE_MODULES if name in sys.modules),
+}
+app.destroy()
+print(json.dumps(result))
+'''
+
+CHILD_SUBSYSTEMS = r'''
+import importlib
+import numpy, PIL.Image
+results = []
+rss = rss_mb()
+results.append({"module": "baseline (numpy, Pillow)", "import_s": time.perf_counter() - started,
+                "rss_before_mb": 0.0, "rss_after_mb": rss})
+for name in SUBSYSTEMS:
+    before = rss_mb()
+    t0 = time.perf_counter()
+    importlib.import_module(name)
+    results.append({"module": name, "import_s": time.perf_counter() - t0,
+                    "rss_before_mb": before, "rss_after_mb": rss_mb()})
+print(json.dumps(results))
+'''
+
+
+def run_child(body):
+    code = f"PROJECT_ROOT = {PROJECT_ROOT!r}\nSUBSYSTEMS = {SUBSYSTEMS!r}\n" + CHILD_PRELUDE + body
+    env = dict(os.environ, BGXUP_PRELOAD="0")
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--no-gui", action="store_true", help="skip the time-to-first-frame measurement")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement; the median is reported")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    report = {}
+
+    runs = [run_child(CHILD_SUBSYSTEMS) for _ in range(args.repeat)]
+    report["subsystems"] = [
+        {
+            "module": entries[0]["module"],
+            "import_s": median([entry["import_s"] for entry in entries]),
+            "rss_before_mb": median([entry["rss_before_mb"] for entry in entries]),
+            "rss_after_mb": median([entry["rss_after_mb"] for entry in entries]),
+        }
+        for entries in zip(*runs)
+    ]
+    print("Subsystem                   import   RSS before    RSS after")
+    for entry in report["subsystems"]:
+        print(f"{entry['module']:<26} {entry['import_s']:6.2f}s  {entry['rss_before_mb']:8.1f} MB "
+              f"{entry['rss_after_mb']:8.1f} MB")
+
+    if not args.no_gui:
+        runs = [run_child(CHILD_GUI) for _ in range(args.repeat)]
+        report["gui"] = {key: median([run[key] for run in runs])
+                         for key in ("import_s", "first_frame_s", "rss_before_mb", "rss_first_frame_mb")}
+        report["gui"]["inference_modules_loaded"] = runs[-1]["inference_modules_loaded"]
+        gui = report["gui"]
+        print()
+        print(f"Import of removebg:  {gui['import_s']:.2f}s")
+        print(f"First frame:         {gui['first_frame_s']:.2f}s")
+        print(f"RSS at first frame:  {gui['rss_first_frame_mb']:.1f} MB")
+        print(f"Inference modules loaded before first frame: {gui['inference_modules_loaded'] or 'none'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
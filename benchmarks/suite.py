@@ -0,0 +1,435 @@
+"""Benchmarks every pipeline stage on synthetic images and compares the results with a baseline.
+
+Run from the project root:
+    python benchmarks/suite.py --models-dir ~/.u2net --weights-dir weights/ -o results.json
+    python benchmarks/suite.py --models-dir ~/.u2net --weights-dir weights/ --compare baseline.json
+
+Runs offline: segmentation models are read from --models-dir (as <model>.onnx) and the
+EDSR weights from --weights-dir, laid out as for BGXUP_WEIGHTS_DIR. Benchmarks whose
+model files are missing are skipped, never downloaded. Each benchmark and size runs in
+a fresh interpreter, so its peak memory is its own. Without a display, the slider
+benchmarks time the same resampling and cropping without Tk and are tagged "headless".
+
+With --compare, a benchmark whose median latency or peak memory grew by more than
+--threshold over the baseline is reported as a regression and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from _common import synthetic_image  # noqa: E402
+
+DEFAULT_SIZES = "512x512,1024x768,2048x1536"
+# EDSR on a CPU takes minutes for the larger sizes above
+DEFAULT_UPSCALE_SIZES = "256x256,512x384"
+DEFAULT_THRESHOLD = 0.10
+
+# Slider canvas sizes the resize benchmark alternates between, so every call resamples
+SLIDER_SIZES = ((800, 600), (640, 480))
+# Separator positions drawn per crop benchmark call, as in one drag across the image
+SLIDER_POSITIONS = 50
+
+# Background colors the preview compositing benchmark alternates between, so every call composites
+BACKGROUND_COLORS = ("#3366cc", "#ffffff")
+
+BENCHMARKS = ("remove", "remove_alpha_matting", "upscale_2x", "composite_preview", "composite_save",
+              "slider_resize", "slider_crop", "save_png", "save_jpeg", "save_webp", "export_all")
+
+
+class Skipped(Exception):
+    """Raised by a benchmark's setup when it cannot run here, e.g. without its model file."""
+
+
+def _rembg_session(args, model_name):
+    path = os.path.join(args.models_dir or "", f"{model_name}.onnx")
+    if not os.path.isfile(path):
+        raise Skipped(f"{path} not found")
+    from profiles import new_session
+
+    return new_session(model_name, args.profile, args.threads)
+
+
+def setup_remove(args, size, alpha_matting=False):
+    from rembg import remove
+
+    session = _rembg_session(args, args.model)
+    image = synthetic_image(*size).convert("RGBA")
+    return lambda: remove(image, session=session, alpha_matting=alpha_matting)
+
+
+def setup_upscale(args, size):
+    from upscaler import EdsrModelRegistry, upscale
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    registry = EdsrModelRegistry(weights_dir=args.weights_dir, profile=args.profile, threads=args.threads)
+    if registry.resolve_source(2) == registry.model_id:
+        raise Skipped("no local EDSR 2x weights, pass --weights-dir")
+    model = registry.get(2)
+    image = synthetic_image(*size).convert("RGBA")
+    return lambda: upscale(image, model)
+
+
+def _tk_root():
+    """Return a hidden Tk root window, or None without a display."""
+    import tkinter
+
+    try:
+        import customtkinter
+        root = customtkinter.CTk()
+    except tkinter.TclError:
+        return None
+    root.withdraw()
+    return root
+
+
+def setup_slider(args, size, crop=False):
+    """Time the before/after slider, through the real widget when a display is available."""
+    from PIL import Image
+
+    os.environ.setdefault("BGXUP_PRELOAD", "0")
+    from removebg import BeforeAfterSliderFrame, PreviewPyramid
+
+    original = synthetic_image(*size).convert("RGBA")
+    processed = synthetic_image(*size, transparent=True)
+    root = _tk_root()
+
+    if root is not None:
+        frame = BeforeAfterSliderFrame(root, width=SLIDER_SIZES[0][0], height=SLIDER_SIZES[0][1])
+        frame.pack(fill="both", expand=True)
+        frame.show_images(original, processed)
+        root.update()
+        calls = [0]
+
+        def resize():
+            calls[0] += 1
+            frame.width, frame.height = SLIDER_SIZES[calls[0] % 2]
+            frame._refresh(final=True)
+            root.update_idletasks()
+
+        def sweep():
+            left = (frame.width - frame.resized_image1_pil.width) / 2
+            for position in range(SLIDER_POSITIONS):
+                frame.separator_pos = left + frame.resized_image1_pil.width * position / SLIDER_POSITIONS
+                frame._redraw_images()
+            root.update_idletasks()
+
+        return (sweep if crop else resize), "tk"
+
+    # Headless: the same pyramid resampling and per-position crops, without the Tk photo copies
+    pyramids = [PreviewPyramid(original), PreviewPyramid(processed)]
+    calls = [0]
+
+    def resize_headless():
+        calls[0] += 1
+        canvas = SLIDER_SIZES[calls[0] % 2]
+        ratio = min(canvas[0] / size[0], canvas[1] / size[1])
+        target = (int(size[0] * ratio), int(size[1] * ratio))
+        return [pyramid.resized(target, Image.LANCZOS) for pyramid in pyramids]
+
+    previews = resize_headless()
+
+    def sweep_headless():
+        width, height = previews[0].size
+        for position in range(SLIDER_POSITIONS):
+            split = width * position // SLIDER_POSITIONS
+            previews[1].crop((0, 0, split, height))
+            previews[0].crop((split, 0, width, height))
+
+    return (sweep_headless if crop else resize_headless), "headless"
+
+
+def setup_composite_preview(args, size):
+    """Time the slider's preview over a new background color, as picking a color does.
+
+    Goes through the real widget's _preview when a display is available; without one, times
+    the same pyramid resampling and compositing without the Tk photo.
+    """
+    from PIL import Image
+
+    os.environ.setdefault("BGXUP_PRELOAD", "0")
+    from removebg import BeforeAfterSliderFrame, PreviewPyramid
+
+    processed = synthetic_image(*size, transparent=True)
+    root = _tk_root()
+    calls = [0]
+
+    if root is not None:
+        frame = BeforeAfterSliderFrame(root, width=SLIDER_SIZES[0][0], height=SLIDER_SIZES[0][1])
+        frame.pack(fill="both", expand=True)
+        root.update()
+
+        def composite():
+            calls[0] += 1
+            frame._preview("processed", processed, True, BACKGROUND_COLORS[calls[0] % 2])
+
+        return composite, "tk"
+
+    pyramid = PreviewPyramid(processed)
+    ratio = min(SLIDER_SIZES[0][0] / size[0], SLIDER_SIZES[0][1] / size[1])
+    target = (int(size[0] * ratio), int(size[1] * ratio))
+
+    def composite_headless():
+        calls[0] += 1
+        resized = pyramid.resized(target, Image.LANCZOS)
+        return Image.alpha_composite(Image.new("RGBA", resized.size, BACKGROUND_COLORS[calls[0] % 2]), resized)
+
+    return composite_headless, "headless"
+
+
+def setup_composite_save(args, size):
+    """Time the app's final_image, compositing the full-resolution image as the first save does."""
+    from types import SimpleNamespace
+
+    os.environ.setdefault("BGXUP_PRELOAD", "0")
+    from removebg import AdvancedBackgroundRemoverApp
+
+    image = synthetic_image(*size, transparent=True)
+    app = SimpleNamespace(_composited=None)
+
+    def composite():
+        # Forget the last composite, which the app reuses until the image or color changes
+        app._composited = None
+        return AdvancedBackgroundRemoverApp.final_image(app, image, BACKGROUND_COLORS[0])
+
+    return composite
+
+
+def setup_save(args, size, output_format):
+    """Encode a processed image in memory with the settings of --export-preset, as the Save button does."""
+    import io
+
+    from export import FORMATS, encoder_options
+
+    image = synthetic_image(*size, transparent=True)
+    if output_format == "jpg":
+        image = image.convert("RGB")
+    options = encoder_options(output_format, args.export_preset)
+
+    def save():
+        image.save(io.BytesIO(), FORMATS[output_format], **options)
+
+    return save, args.export_preset
+
+
+def setup_export_all(args, size):
+    """Write a processed image as PNG, JPG and WebP at once, as Export All Formats does."""
+    import atexit
+    import shutil
+    import tempfile
+
+    from export import encoder_options, export_many
+
+    image = synthetic_image(*size, transparent=True)
+    output_dir = tempfile.mkdtemp(prefix="bgxup-bench-")
+    atexit.register(shutil.rmtree, output_dir, ignore_errors=True)
+    targets = [(os.path.join(output_dir, f"export.{output_format}"), output_format,
+                encoder_options(output_format, args.export_preset)) for output_format in ("png", "jpg", "webp")]
+    return (lambda: export_many(image, targets)), args.export_preset
+
+
+SETUPS = {
+    "remove": lambda args, size: setup_remove(args, size),
+    "remove_alpha_matting": lambda args, size: setup_remove(args, size, alpha_matting=True),
+    "upscale_2x": setup_upscale,
+    "composite_preview": setup_composite_preview,
+    "composite_save": setup_composite_save,
+    "slider_resize": lambda args, size: setup_slider(args, size),
+    "slider_crop": lambda args, size: setup_slider(args, size, crop=True),
+    "save_png": lambda args, size: setup_save(args, size, "png"),
+    "save_jpeg": lambda args, size: setup_save(args, size, "jpg"),
+    "save_webp": lambda args, size: setup_save(args, size, "webp"),
+    "export_all": setup_export_all,
+}
+
+
+def percentile(values, point):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(point / 100 * (len(values) - 1))))]
+
+
+def run_case(args, name, size):
+    """Set up and time one benchmark at one size in this process and return its result."""
+    from image_io import memory_usage, peak_memory_usage
+
+    result = {"name": name, "size": f"{size[0]}x{size[1]}", "mode": "default"}
+    try:
+        setup = SETUPS[name](args, size)
+    except Skipped as e:
+        result["skipped"] = str(e)
+        return result
+    fn, result["mode"] = setup if isinstance(setup, tuple) else (setup, "default")
+
+    # Warm up, so first-run allocations and lazy initialisation are not measured
+    for _ in range(args.warmup):
+        fn()
+    rss_before = memory_usage()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        call_started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    median = percentile(latencies, 50)
+    result.update({
+        "repeat": args.repeat,
+        "latency_ms": {"min": min(latencies) * 1000, "median": median * 1000,
+                       "p95": percentile(latencies, 95) * 1000, "max": max(latencies) * 1000},
+        "throughput_per_s": args.repeat / elapsed,
+        "megapixels_per_s": size[0] * size[1] / 1e6 / median,
+        "rss_before_mb": rss_before / 2 ** 20 if rss_before is not None else None,
+        "peak_rss_mb": (peak_memory_usage() or 0) / 2 ** 20 or None,
+    })
+    return result
+
+
+def run_isolated(args, name, size):
+    """Run one benchmark in a fresh interpreter and return its result."""
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", name, "--sizes", f"{size[0]}x{size[1]}",
+               "--repeat", str(args.repeat), "--warmup", str(args.warmup), "--model", args.model,
+               "--profile", args.profile, "--export-preset", args.export_preset]
+    for option, value in (("--models-dir", args.models_dir), ("--weights-dir", args.weights_dir),
+                          ("--threads", args.threads)):
+        if value:
+            command += [option, str(value)]
+
+    env = dict(os.environ, BGXUP_PRELOAD="0", BGXUP_CACHE="0", HF_HUB_OFFLINE="1")
+    if args.models_dir:
+        env["U2NET_HOME"] = args.models_dir
+    if args.threads:
+        env["OMP_NUM_THREADS"] = str(args.threads)
+    completed = subprocess.run(command, capture_output=True, text=True, env=env, cwd=PROJECT_ROOT)
+    if completed.returncode != 0:
+        error = (completed.stderr.strip().splitlines() or ["failed"])[-1]
+        return {"name": name, "size": f"{size[0]}x{size[1]}", "mode": "default", "error": error}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def environment():
+    """Describe the machine and library versions, so results are only compared with like."""
+    from disk_cache import package_version
+
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "packages": {name: package_version(name) for name in
+                     ("numpy", "Pillow", "onnxruntime", "rembg", "torch", "super-image", "customtkinter")},
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return (benchmark key, metric, baseline value, new value, ratio) for every regression."""
+    previous = {(entry["name"], entry["size"], entry["mode"]): entry
+                for entry in baseline["results"] if "latency_ms" in entry}
+    regressions = []
+    for entry in results:
+        key = (entry["name"], entry["size"], entry["mode"])
+        if "latency_ms" not in entry or key not in previous:
+            continue
+        metrics = [("median latency ms", previous[key]["latency_ms"]["median"], entry["latency_ms"]["median"]),
+                   ("peak RSS MB", previous[key].get("peak_rss_mb"), entry.get("peak_rss_mb"))]
+        for metric, old, new in metrics:
+            if old and new and new > old * (1 + threshold):
+                regressions.append((key, metric, old, new, new / old))
+    return regressions
+
+
+def print_results(results):
+    print(f"{'benchmark':<22} {'size':>10} {'mode':>9} {'median':>10} {'p95':>10} {'per s':>8} {'MP/s':>8} "
+          f"{'peak RSS':>10}")
+    for entry in results:
+        label = f"{entry['name']:<22} {entry['size']:>10} {entry['mode']:>9}"
+        if "latency_ms" in entry:
+            peak = f"{entry['peak_rss_mb']:7.1f} MB" if entry.get("peak_rss_mb") else "        -"
+            print(f"{label} {entry['latency_ms']['median']:8.1f}ms {entry['latency_ms']['p95']:8.1f}ms "
+                  f"{entry['throughput_per_s']:8.2f} {entry['megapixels_per_s']:8.2f} {peak:>10}")
+        else:
+            print(f"{label}  {'skipped: ' + entry['skipped'] if 'skipped' in entry else 'ERROR: ' + entry['error']}")
+
+
+def parse_sizes(text):
+    return [tuple(int(v) for v in size.lower().split("x")) for size in text.split(",") if size]
+
+
+def parse_args(argv=None):
+    from export import DEFAULT_PRESET, PRESETS
+    from profiles import DEFAULT_PROFILE, PROFILES
+    from sessions import DEFAULT_MODEL
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models-dir", help="folder with the rembg .onnx files (U2NET_HOME)")
+    parser.add_argument("--weights-dir", help="local EDSR weights, laid out as for BGXUP_WEIGHTS_DIR")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="rembg segmentation model")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE, help="inference profile")
+    parser.add_argument("--export-preset", choices=list(PRESETS), default=DEFAULT_PRESET,
+                        help="encoder settings for the save and export benchmarks, reported as their mode")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma separated benchmarks to run")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated image sizes, WIDTHxHEIGHT")
+    parser.add_argument("--upscale-sizes", default=DEFAULT_UPSCALE_SIZES, help="image sizes for upscale_2x")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark and size")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the timed ones")
+    parser.add_argument("--threads", type=int, help="pin torch and ONNX Runtime to this many threads")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file from an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative growth in median latency or peak memory counted as a regression")
+    parser.add_argument("--run-case", choices=BENCHMARKS, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(args, args.run_case, parse_sizes(args.sizes)[0])))
+        return 0
+
+    names = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown = sorted(set(names) - set(BENCHMARKS))
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    results = []
+    for name in names:
+        for size in parse_sizes(args.upscale_sizes if name == "upscale_2x" else args.sizes):
+            print(f"Running {name} at {size[0]}x{size[1]}...", file=sys.stderr)
+            results.append(run_isolated(args, name, size))
+
+    print_results(results)
+    report = {"environment": environment(), "settings": {"model": args.model, "profile": args.profile,
+                                                          "repeat": args.repeat, "threads": args.threads},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print()
+        if not regressions:
+            print(f"No regressions over {args.threshold:.0%} against {args.compare}")
+        for (name, size, mode), metric, old, new, ratio in regressions:
+            print(f"REGRESSION {name} {size} ({mode}): {metric} {old:.1f} -> {new:.1f} ({ratio:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Content-addressed on-disk cache of segmentation masks and upscaled images.
+
+Entries are keyed by a hash of the image pixels, the model name and version and
+the processing parameters, and stored as PNG files. The least recently used
+entries are evicted once the cache grows past its size cap. Hit and miss counts
+are added up in a stats file in the cache directory, across every process using it.
+
+Command line:
+    python disk_cache.py stats
+    python disk_cache.py prune [--max-size MB] [--older-than DAYS] [--all]
+"""
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+from PIL import Image, PngImagePlugin
+
+CACHE_DIR_ENV = "BGXUP_CACHE_DIR"
+DEFAULT_MAX_SIZE_MB = 2048
+
+# Bumped whenever the stored format or the meaning of a key changes
+CACHE_FORMAT_VERSION = 1
+
+STATS_FILE = "stats.jsonl"
+STATS_COUNTERS = ("hits", "misses", "bytes_saved", "seconds_saved")
+# How often a long-running process adds its counters to the stats file, besides at exit
+STATS_SAVE_SECONDS = 60
+
+
+def default_cache_dir():
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "bgxup")
+
+
+def package_version(name):
+    """Return the installed version of a package, or "unknown"."""
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return "unknown"
+
+
+def image_digest(image):
+    """Hash the pixels, mode and size of a PIL image."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """A size-capped, least recently used cache of images on disk."""
+
+    def __init__(self, directory=None, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.directory = directory or default_cache_dir()
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self._lock = threading.Lock()
+        self._size = None
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+        # Counter values already added to the stats file
+        self._saved = dict.fromkeys(STATS_COUNTERS, 0)
+        self._stats_saved_at = time.monotonic()
+        atexit.register(self.save_stats)
+
+    def key(self, image, model, version, params=None):
+        """Build the cache key for processing an image with a model and parameters."""
+        description = json.dumps({
+            "format": CACHE_FORMAT_VERSION,
+            "image": image_digest(image),
+            "model": model,
+            "version": version,
+            "params": params or {},
+        }, sort_keys=True)
+        return hashlib.blake2b(description.encode(), digest_size=20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".png")
+
+    def get(self, key):
+        """Return the cached image for a key, or None."""
+        path = self._path(key)
+        try:
+            with Image.open(path) as stored:
+                stored.load()
+                image = stored.copy()
+                info = dict(stored.info)
+            size = os.path.getsize(path)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            self._save_stats_periodically()
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+            self.seconds_saved += float(info.get("compute_seconds", 0.0))
+        self._save_stats_periodically()
+        image.info.clear()
+        image.info.update({name: value for name, value in info.items() if name.startswith("bgxup_")})
+        return image
+
+    def put(self, key, image, compute_seconds=0.0, metadata=None):
+        """Store an image under a key, evicting old entries if the cache is over its cap."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text("compute_seconds", f"{compute_seconds:.6f}")
+        for name, value in (metadata or {}).items():
+            pnginfo.add_text(f"bgxup_{name}", str(value))
+
+        # Write to a temporary name first, so other processes never read a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            image.save(temp_path, "PNG", pnginfo=pnginfo, compress_level=6)
+            # Rewriting a key replaces its file, whose size no longer counts towards the cap
+            try:
+                replaced_size = os.path.getsize(path)
+            except OSError:
+                replaced_size = 0
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path) - replaced_size
+        self._evict()
+
+    def _entries(self):
+        """Return (mtime, size, path) for every cached file."""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if entry.name.endswith(".png"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """Return the total size of the cache in bytes."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    def _evict(self):
+        if self.max_size_bytes is None or self.size() <= self.max_size_bytes:
+            return
+        # Leave some headroom so the next few puts do not trigger another scan
+        self.prune(max_bytes=int(self.max_size_bytes * 0.9))
+
+    def prune(self, max_bytes=None, older_than=None):
+        """Remove least recently used entries until the cache fits, and any older than `older_than` seconds.
+
+        With neither limit given, everything is removed. Returns (files removed, bytes removed).
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        removed_files = removed_bytes = 0
+
+        for mtime, size, path in entries:
+            too_old = older_than is not None and now - mtime > older_than
+            too_big = max_bytes is not None and total - removed_bytes > max_bytes
+            remove_all = max_bytes is None and older_than is None
+            if not (too_old or too_big or remove_all):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # Another process evicted it first
+                continue
+            removed_files += 1
+            removed_bytes += size
+
+        with self._lock:
+            self._size = total - removed_bytes
+        return removed_files, removed_bytes
+
+    def _counters(self):
+        return {name: getattr(self, name) for name in STATS_COUNTERS}
+
+    def stats(self):
+        """Return hit and miss counters for this process."""
+        with self._lock:
+            return _with_hit_rate(self._counters())
+
+    def _save_stats_periodically(self):
+        if time.monotonic() - self._stats_saved_at >= STATS_SAVE_SECONDS:
+            self.save_stats()
+
+    def save_stats(self):
+        """Add the counts since the last save to the totals in the cache directory."""
+        with self._lock:
+            counters = self._counters()
+            delta = {name: counters[name] - self._saved[name] for name in STATS_COUNTERS}
+            self._saved = counters
+            self._stats_saved_at = time.monotonic()
+        if not any(delta.values()):
+            return
+        # Each process appends one short line rather than rewriting a total, so processes
+        # sharing the cache never overwrite each other's counts
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, STATS_FILE), "a") as stats_file:
+                stats_file.write(json.dumps(delta) + "\n")
+        except OSError:
+            pass
+
+    def total_stats(self):
+        """Return hit and miss counters summed over every process that has used the cache directory."""
+        totals = dict.fromkeys(STATS_COUNTERS, 0)
+        try:
+            with open(os.path.join(self.directory, STATS_FILE)) as stats_file:
+                for line in stats_file:
+                    try:
+                        counts = json.loads(line)
+                    except ValueError:
+                        # A line cut short when a process was killed mid-write
+                        continue
+                    for name in STATS_COUNTERS:
+                        totals[name] += counts.get(name, 0)
+        except OSError:
+            pass
+        return _with_hit_rate(totals)
+
+
+def _with_hit_rate(counters):
+    lookups = counters["hits"] + counters["misses"]
+    return dict(counters, hit_rate=counters["hits"] / lookups if lookups else 0.0)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or prune the BGXUP result cache.")
+    parser.add_argument("--cache-dir", help=f"cache directory (default: ${CACHE_DIR_ENV} or ~/.cache/bgxup)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="show the number and size of cached entries and how often they were used")
+    prune = commands.add_parser("prune", help="remove cached entries")
+    prune.add_argument("--max-size", type=float, help="shrink the cache to at most this many MB")
+    prune.add_argument("--older-than", type=float, help="remove entries not used for this many days")
+    prune.add_argument("--all", action="store_true", help="remove every entry")
+    args = parser.parse_args(argv)
+
+    cache = DiskCache(args.cache_dir, max_size_mb=None)
+    if args.command == "stats":
+        entries = cache._entries()
+        print(f"{cache.directory}: {len(entries)} entries, {format_bytes(sum(size for _, size, _ in entries))}")
+        totals = cache.total_stats()
+        lookups = totals["hits"] + totals["misses"]
+        if lookups:
+            print(f"{totals['hits']}/{lookups} hits ({totals['hit_rate']:.0%}), "
+                  f"{format_bytes(totals['bytes_saved'])} read instead of recomputed, "
+                  f"{totals['seconds_saved']:.1f}s of processing saved")
+        return 0
+
+    if not (args.all or args.max_size is not None or args.older_than is not None):
+        parser.error("prune needs --max-size, --older-than or --all")
+    files, size = cache.prune(
+        max_bytes=None if args.max_size is None else int(args.max_size * 1024 * 1024),
+        older_than=None if args.older_than is None else args.older_than * 86400,
+    )
+    print(f"Removed {files} entries, {format_bytes(size)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,171 @@
+"""Encoding processed images to PNG, JPEG and WebP with tunable settings.
+
+    options = encoder_options("webp", "smallest", lossless=True)
+    save_image(image, "out.webp", "webp", options)
+    export_many(image, [("out.png", "png", None), ("out.jpg", "jpg", None)])
+
+The settings default to Pillow's own, so a plain save_image() writes the same file
+image.save() would. Every file is written next to its final name and renamed into
+place, so an interrupted export never leaves a truncated file behind.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+
+# Output formats by the extension used in file names
+FORMATS = {"png": "PNG", "jpg": "JPEG", "webp": "WEBP"}
+EXTENSIONS = {".png": "png", ".jpg": "jpg", ".jpeg": "jpg", ".webp": "webp"}
+
+# Pillow's defaults for each format, so exports match a plain image.save() unless tuned
+DEFAULT_OPTIONS = {
+    "png": {"compress_level": 6, "optimize": False},
+    "jpg": {"quality": 75, "subsampling": "4:2:0", "optimize": False, "progressive": False},
+    "webp": {"lossless": False, "quality": 80, "method": 4},
+}
+
+JPEG_SUBSAMPLING = ("4:4:4", "4:2:2", "4:2:0")
+
+# Named trade-offs between encoding time, file size and fidelity. PNG and lossless WebP
+# only trade time for size; JPEG and lossy WebP also trade away detail.
+PRESETS = {
+    "default": {},
+    # zlib level 1 is several times faster than 6 on photos for a slightly larger file
+    "fast": {
+        "png": {"compress_level": 1},
+        "jpg": {"quality": 90},
+        "webp": {"quality": 90, "method": 0},
+    },
+    "smallest": {
+        "png": {"compress_level": 9, "optimize": True},
+        "jpg": {"quality": 85, "optimize": True, "progressive": True},
+        "webp": {"quality": 80, "method": 6},
+    },
+    # Full-resolution chroma keeps the colored edges of cutouts crisp in JPEG
+    "best": {
+        "jpg": {"quality": 95, "subsampling": "4:4:4"},
+        "webp": {"lossless": True},
+    },
+}
+DEFAULT_PRESET = "default"
+
+
+def format_for_path(path):
+    """Return the output format for a file name from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f"Unsupported file type '{extension or path}', use one of "
+                         f"{', '.join(sorted(EXTENSIONS))}.")
+    return EXTENSIONS[extension]
+
+
+def output_path_for(input_path, output_dir, output_format, keep_extension=False):
+    """Return the <name>-processed.<format> path an input is written to in output_dir."""
+    file_name_without_ext, extension = os.path.splitext(os.path.basename(input_path))
+    if keep_extension:
+        file_name_without_ext += "-" + extension[1:].lower()
+    return os.path.join(output_dir, f"{file_name_without_ext}-processed.{output_format}")
+
+
+def output_paths(input_paths, output_dir, output_format):
+    """Map each input to its output path, and list the outputs several inputs would share.
+
+    Inputs are written to <name>-processed.<format>. Inputs sharing a name but not an
+    extension, such as a.jpg and a.png, keep their extension: a-jpg-processed.png. Inputs
+    with the same file name in different folders would still overwrite each other, so
+    they are left out of the mapping and returned as (output path, inputs) conflicts.
+    """
+    extensions = {}
+    for input_path in input_paths:
+        stem, extension = os.path.splitext(os.path.basename(input_path).lower())
+        extensions.setdefault(stem, set()).add(extension)
+
+    claimed = {}
+    for input_path in input_paths:
+        stem = os.path.splitext(os.path.basename(input_path).lower())[0]
+        output_path = output_path_for(input_path, output_dir, output_format,
+                                      keep_extension=len(extensions[stem]) > 1)
+        # Compared without case, since Windows and macOS file names ignore it
+        claimed.setdefault(output_path.lower(), []).append((input_path, output_path))
+
+    outputs = {}
+    conflicts = []
+    for claims in claimed.values():
+        if len(claims) == 1:
+            input_path, output_path = claims[0]
+            outputs[input_path] = output_path
+        else:
+            conflicts.append((claims[0][1], [input_path for input_path, _ in claims]))
+    return outputs, conflicts
+
+
+def encoder_options(output_format, preset=DEFAULT_PRESET, **overrides):
+    """Return the encoder settings of a format for a preset, with individual settings overridden."""
+    options = dict(DEFAULT_OPTIONS[output_format])
+    options.update(PRESETS[preset].get(output_format, {}))
+    options.update({name: value for name, value in overrides.items() if value is not None})
+    return options
+
+
+def _mode_for(image, output_format):
+    """Return the mode an image is encoded in for a format."""
+    if output_format == "jpg":
+        # JPEG has no alpha channel; transparent pixels keep the color stored under them
+        return "RGB" if image.mode in ("RGBA", "LA", "P") else image.mode
+    return image.mode
+
+
+def save_image(image, path, output_format=None, options=None):
+    """Encode an image to a file and return the number of bytes written."""
+    output_format = output_format or format_for_path(path)
+    options = options or encoder_options(output_format)
+    mode = _mode_for(image, output_format)
+    if image.mode != mode:
+        image = image.convert(mode)
+    return _write(image, path, output_format, options)
+
+
+def _write(image, path, output_format, options):
+    temp_path = path + ".part"
+    try:
+        with profiling.stage("save", format=output_format, size=list(image.size)):
+            image.save(temp_path, FORMATS[output_format], **options)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return os.path.getsize(path)
+
+
+def export_many(image, targets, workers=None):
+    """Encode one image to several files at once.
+
+    targets holds (path, format, options) tuples, with None for the default options.
+    Pillow's encoders release the GIL, so the files are encoded in parallel threads
+    from the one in-memory image; a conversion several targets need, such as dropping
+    alpha for JPEG, is done once and shared. Returns (path, bytes, seconds, error)
+    per target, in order.
+    """
+    # Loading is not thread safe, so make sure the pixels are in memory before sharing them
+    image.load()
+    sources = {image.mode: image}
+    for _, output_format, _ in targets:
+        mode = _mode_for(image, output_format)
+        if mode not in sources:
+            sources[mode] = image.convert(mode)
+
+    def encode(target):
+        path, output_format, options = target
+        started = time.perf_counter()
+        try:
+            size = _write(sources[_mode_for(image, output_format)], path, output_format,
+                          options or encoder_options(output_format))
+        except Exception as e:
+            return path, None, time.perf_counter() - started, e
+        return path, size, time.perf_counter() - started, None
+
+    workers = workers or min(len(targets), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as executor:
+        return list(executor.map(encode, targets))
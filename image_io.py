@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+
+from PIL import Image
+
+import profiling
+
+# Longest side of the preview decoded when an image is opened
+DEFAULT_PREVIEW_SIZE = 2048
+
+
+def memory_usage():
+    """Return the resident memory of this process in bytes, or None if it cannot be determined."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_memory_usage():
+    """Return the highest resident memory this process has reached, in bytes, or None if unknown."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    except ImportError:
+        return None
+
+
+class LazyImage:
+    """An image file that shows a cheap preview first and decodes in full only when processing needs it.
+
+    Opening reads just the header. preview() decodes a reduced copy, using JPEG draft
+    mode to decode at 1/2, 1/4 or 1/8 scale directly. load() decodes the full RGBA
+    image once and returns the same object afterwards, so callers share it instead
+    of copying; none of them modify images in place.
+    """
+
+    def __init__(self, path, preview_size=DEFAULT_PREVIEW_SIZE):
+        self.path = path
+        self.preview_size = preview_size
+        with Image.open(path) as source:
+            self.size = source.size
+            self.format = source.format
+
+        self._preview = None
+        self._image = None
+        self._lock = threading.Lock()
+        # Resident memory after each loading stage, for reporting
+        self.memory = {"open": memory_usage()}
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def decoded(self):
+        """The full image if it has been decoded already, else None."""
+        return self._image
+
+    def preview(self):
+        """Return an RGBA copy no larger than preview_size on either side."""
+        with self._lock:
+            if self._preview is None:
+                with profiling.stage("preview decode", size=list(self.size)), Image.open(self.path) as source:
+                    ratio = min(1.0, self.preview_size / max(self.size))
+                    target = (max(1, round(self.width * ratio)), max(1, round(self.height * ratio)))
+                    # JPEG decodes straight at the smallest 1/2, 1/4 or 1/8 scale that still covers the preview
+                    source.draft("RGB", target)
+                    source.thumbnail(target, Image.LANCZOS)
+                    self._preview = source.convert("RGBA")
+                self.memory["preview"] = memory_usage()
+            return self._preview
+
+    def load(self):
+        """Decode the full RGBA image on first use and return it."""
+        with self._lock:
+            if self._image is None:
+                if self._preview is not None and self._preview.size == self.size:
+                    # Small images were already decoded in full for the preview
+                    self._image = self._preview
+                else:
+                    with profiling.stage("decode", size=list(self.size)), Image.open(self.path) as source:
+                        self._image = source.convert("RGBA")
+                self.memory["decode"] = memory_usage()
+            return self._image
@@ -0,0 +1,167 @@
+import queue
+import threading
+from collections import deque
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled or superseded."""
+
+
+class Job:
+    """A unit of work run on the executor's worker thread."""
+
+    def __init__(self, key, fn, stages=(), on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        self.key = key
+        self.fn = fn
+        self.stages = list(stages)
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_cancel = on_cancel
+        self._cancel_event = threading.Event()
+        self._events = None
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Ask the job to stop at its next progress report."""
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, stage, fraction=0.0):
+        """Report progress within a stage and stop here if the job was cancelled."""
+        self.check_cancelled()
+        if stage in self.stages:
+            overall = (self.stages.index(stage) + min(max(fraction, 0.0), 1.0)) / len(self.stages)
+        else:
+            overall = fraction
+        self._events.put(("progress", self, (stage, overall)))
+
+
+class JobExecutor:
+    """Runs jobs on a worker thread and hands results back to the Tk main loop.
+
+    Jobs share a key when a newer one makes an older one redundant, e.g. repeated
+    removals with different slider values. Submitting a job drops any queued job
+    with the same key and cancels the running one.
+    """
+
+    def __init__(self, widget, poll_interval=50):
+        self.widget = widget
+        self.poll_interval = poll_interval
+
+        self._pending = deque()
+        self._running = None
+        self._condition = threading.Condition()
+        self._events = queue.Queue()
+        self._polling = False
+        self._shutdown = False
+
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def submit(self, key, fn, stages=(), on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        """Queue fn(job) to run in the background and return the Job."""
+        job = Job(key, fn, stages, on_done, on_error, on_progress, on_cancel)
+        job._events = self._events
+
+        with self._condition:
+            for queued in [queued for queued in self._pending if queued.key == key]:
+                self._pending.remove(queued)
+                queued.cancel()
+                self._events.put(("cancelled", queued, None))
+            if self._running is not None and self._running.key == key:
+                self._running.cancel()
+            self._pending.append(job)
+            self._condition.notify()
+
+        self._start_polling()
+        return job
+
+    def cancel(self, key=None):
+        """Cancel queued and running jobs, optionally only those with the given key."""
+        with self._condition:
+            for queued in [queued for queued in self._pending if key is None or queued.key == key]:
+                self._pending.remove(queued)
+                queued.cancel()
+                self._events.put(("cancelled", queued, None))
+            if self._running is not None and (key is None or self._running.key == key):
+                self._running.cancel()
+        self._start_polling()
+
+    def is_busy(self, key=None):
+        """Return True while a matching job is queued or running."""
+        with self._condition:
+            jobs = list(self._pending) + ([self._running] if self._running else [])
+            return any(key is None or job.key == key for job in jobs)
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        self.cancel()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._shutdown:
+                    self._condition.wait()
+                if self._shutdown:
+                    return
+                job = self._pending.popleft()
+                self._running = job
+
+            try:
+                job.check_cancelled()
+                result = job.fn(job)
+                job.check_cancelled()
+                event = ("done", job, result)
+            except JobCancelled:
+                event = ("cancelled", job, None)
+            except Exception as e:
+                event = ("error", job, e)
+
+            # Clear the running job and publish its outcome together, so callbacks
+            # never see the finished job as still busy
+            with self._condition:
+                self._running = None
+                self._events.put(event)
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.widget.after(self.poll_interval, self._poll)
+
+    def _poll(self):
+        """Deliver worker events to their callbacks on the Tk main thread."""
+        while True:
+            try:
+                kind, job, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                # Progress from a job that was superseded since is no longer interesting
+                if job.on_progress and not job.cancelled:
+                    job.on_progress(*payload)
+            elif kind == "done":
+                if job.on_done:
+                    job.on_done(payload)
+            elif kind == "error":
+                if job.on_error:
+                    job.on_error(payload)
+            elif kind == "cancelled":
+                if job.on_cancel:
+                    job.on_cancel()
+
+        with self._condition:
+            keep_polling = self._pending or self._running or not self._events.empty()
+        if keep_polling:
+            self.widget.after(self.poll_interval, self._poll)
+        else:
+            self._polling = False
@@ -0,0 +1,325 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import profiling
+
+# Stages reported by remove_background, in order
+REMOVE_STAGES = ("loading model", "decode", "inference", "matting", "compositing")
+
+# Longest side of the proxy used for live alpha matting previews
+PREVIEW_MAX_SIZE = 512
+
+# Input normalization (mean, std, size) of the single-output models that can be batched.
+# These mirror the predict() methods of the matching rembg sessions.
+BATCHABLE_MODELS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+# Rough peak activation memory of a U-2-Net style network per input pixel, in bytes
+SEGMENTATION_BYTES_PER_PIXEL = 2048
+MAX_SEGMENTATION_BATCH = 16
+
+
+class MaskCache:
+    """Keeps the raw segmentation masks of recent images, so matting can be redone without the network."""
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image, model_name):
+        """Return (oriented image, masks) for an image and model, or None."""
+        with self._lock:
+            entry = self._entries.get((id(image), model_name))
+            # The entry keeps its source alive, so a matching id is the same image
+            if entry is None or entry[0] is not image:
+                return None
+            self._entries.move_to_end((id(image), model_name))
+            return entry[1], entry[2]
+
+    def put(self, image, model_name, oriented_image, masks):
+        with self._lock:
+            self._entries[(id(image), model_name)] = (image, oriented_image, masks)
+            self._entries.move_to_end((id(image), model_name))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _report(progress, stage, fraction=0.0):
+    if progress:
+        progress(stage, fraction)
+
+
+def cutout(image, mask, alpha_matting=False, foreground_threshold=240, background_threshold=10, erode_size=10):
+    """Cut the foreground out of an image with a segmentation mask, as rembg.remove does."""
+    from rembg.bg import alpha_matting_cutout, naive_cutout
+
+    with profiling.stage("matting" if alpha_matting else "cutout", size=list(image.size)):
+        if alpha_matting:
+            try:
+                return alpha_matting_cutout(image, mask, foreground_threshold, background_threshold, erode_size)
+            except ValueError:
+                # Matting can fail on degenerate trimaps; fall back to the plain cutout
+                return naive_cutout(image, mask)
+        return naive_cutout(image, mask)
+
+
+def _stack_masks(masks):
+    """Stack same-sized masks vertically into one image, for storing them as a single cache entry."""
+    stacked = Image.new("L", (masks[0].width, masks[0].height * len(masks)))
+    for index, mask in enumerate(masks):
+        stacked.paste(mask.convert("L"), (0, index * masks[0].height))
+    return stacked
+
+
+def _unstack_masks(stacked, count):
+    height = stacked.height // count
+    return [stacked.crop((0, index * height, stacked.width, (index + 1) * height)) for index in range(count)]
+
+
+def _mask_params(session):
+    """Cache key parameters of a session's masks; quantized sessions set a variant and are kept apart."""
+    params = {"output": "masks"}
+    if getattr(session, "variant", None):
+        params["variant"] = session.variant
+    return params
+
+
+def _input_shape(session, batch=1):
+    """The shape of the tensor a session's network is fed, when it is known."""
+    if session.model_name not in BATCHABLE_MODELS:
+        return None
+    width, height = BATCHABLE_MODELS[session.model_name][2]
+    return [batch, 3, height, width]
+
+
+def _predict(session, image):
+    """Run session.predict on one image as a profiled inference stage."""
+    with profiling.stage("inference", model=session.model_name, input_shape=_input_shape(session),
+                         image_size=list(image.size)):
+        return session.predict(image)
+
+
+def segment(image, session, mask_cache=None, progress=None, disk_cache=None):
+    """Return the orientation-corrected image and its segmentation masks, reusing cached masks.
+
+    mask_cache holds masks in memory for the current session; disk_cache persists them across runs.
+    """
+    from rembg.bg import fix_image_orientation
+
+    if mask_cache is not None:
+        cached = mask_cache.get(image, session.model_name)
+        if cached is not None:
+            return cached
+
+    _report(progress, "decode")
+    with profiling.stage("orientation"):
+        oriented_image = fix_image_orientation(image)
+
+    _report(progress, "inference")
+    masks = None
+    if disk_cache is not None:
+        from disk_cache import package_version
+
+        key = disk_cache.key(oriented_image, session.model_name, package_version("rembg"), _mask_params(session))
+        stored = disk_cache.get(key)
+        if stored is not None:
+            masks = _unstack_masks(stored, int(stored.info.get("bgxup_count", 1)))
+
+    if masks is None:
+        started = time.perf_counter()
+        masks = _predict(session, oriented_image)
+        if disk_cache is not None and masks:
+            disk_cache.put(key, _stack_masks(masks), time.perf_counter() - started, {"count": len(masks)})
+
+    if mask_cache is not None:
+        mask_cache.put(image, session.model_name, oriented_image, masks)
+    return oriented_image, masks
+
+
+def segmentation_batch_size(model_name, memory_budget_mb=None, max_batch=MAX_SEGMENTATION_BATCH):
+    """Pick how many images fit in one inference call under the memory budget."""
+    from upscaler import DEFAULT_MEMORY_BUDGET_MB, available_memory
+
+    budget = (memory_budget_mb or DEFAULT_MEMORY_BUDGET_MB) * 1024 * 1024
+    free = available_memory()
+    if free is not None:
+        budget = min(budget, free // 4)
+    width, height = BATCHABLE_MODELS.get(model_name, (None, None, (320, 320)))[2]
+    return max(1, min(max_batch, int(budget // (width * height * SEGMENTATION_BYTES_PER_PIXEL))))
+
+
+def _normalize(image, mean, std, size):
+    """Prepare one image as a 3xHxW float32 array, exactly as rembg's BaseSession.normalize does."""
+    im_ary = np.array(image.convert("RGB").resize(size, Image.Resampling.LANCZOS))
+    im_ary = im_ary / max(np.max(im_ary), 1e-6)
+    tmp_img = (im_ary - np.array(mean)) / np.array(std)
+    return tmp_img.transpose((2, 0, 1)).astype(np.float32)
+
+
+def _predictions_to_mask(pred, size):
+    """Turn one HxW network output into a mask of the original image size, as rembg does."""
+    ma = np.max(pred)
+    mi = np.min(pred)
+    pred = (pred - mi) / (ma - mi)
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+def _predict_batch(session, images, batch_size):
+    """Run the segmentation network once per group of images and return one mask per image."""
+    mean, std, size = BATCHABLE_MODELS[session.model_name]
+    input_name = session.inner_session.get_inputs()[0].name
+    masks = []
+    for start in range(0, len(images), batch_size):
+        group = images[start:start + batch_size]
+        with profiling.stage("preprocess", batch=len(group)):
+            batch = np.stack([_normalize(image, mean, std, size) for image in group])
+        with profiling.stage("inference", model=session.model_name, input_shape=list(batch.shape)):
+            predictions = session.inner_session.run(None, {input_name: batch})[0][:, 0, :, :]
+        masks.extend(_predictions_to_mask(pred, image.size) for pred, image in zip(predictions, group))
+    return masks
+
+
+def _supports_batching(session):
+    """Only models with a known preprocessing and a dynamic batch dimension can be batched."""
+    if session.model_name not in BATCHABLE_MODELS or not hasattr(session, "inner_session"):
+        return False
+    batch_dimension = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dimension, int) or batch_dimension != 1
+
+
+def segment_batch(images, session, batch_size=None, memory_budget_mb=None, disk_cache=None, progress=None):
+    """Segment several images with as few network calls as possible.
+
+    Images are resized to the model's input resolution, stacked into one tensor per
+    batch and the masks are resized back to each image's own size. A given batch_size
+    is an upper bound, lowered when fewer images fit in the memory budget. Models that
+    cannot be batched fall back to one call per image. Returns (oriented image, masks)
+    per image.
+    """
+    from rembg.bg import fix_image_orientation
+
+    _report(progress, "decode")
+    with profiling.stage("orientation", images=len(images)):
+        oriented_images = [fix_image_orientation(image) for image in images]
+
+    results = [None] * len(images)
+    keys = [None] * len(images)
+    if disk_cache is not None:
+        from disk_cache import package_version
+
+        for index, oriented_image in enumerate(oriented_images):
+            keys[index] = disk_cache.key(oriented_image, session.model_name, package_version("rembg"),
+                                         _mask_params(session))
+            stored = disk_cache.get(keys[index])
+            if stored is not None:
+                results[index] = (oriented_image, _unstack_masks(stored, int(stored.info.get("bgxup_count", 1))))
+
+    pending = [index for index, result in enumerate(results) if result is None]
+    _report(progress, "inference")
+    if pending:
+        started = time.perf_counter()
+        pending_images = [oriented_images[index] for index in pending]
+        masks = None
+        if _supports_batching(session):
+            batch_size = segmentation_batch_size(session.model_name, memory_budget_mb,
+                                                 max_batch=batch_size or MAX_SEGMENTATION_BATCH)
+            try:
+                masks = [[mask] for mask in _predict_batch(session, pending_images, batch_size)]
+            except Exception:
+                # Some exported models declare a dynamic batch but only run with one image
+                masks = None
+        if masks is None:
+            masks = [_predict(session, image) for image in pending_images]
+
+        # Share the network time evenly, so the cached entries record a fair cost
+        seconds_per_image = (time.perf_counter() - started) / len(pending)
+        for index, image_masks in zip(pending, masks):
+            results[index] = (oriented_images[index], image_masks)
+            if disk_cache is not None and image_masks:
+                disk_cache.put(keys[index], _stack_masks(image_masks), seconds_per_image,
+                               {"count": len(image_masks)})
+    return results
+
+
+def remove_backgrounds(images, session, alpha_matting=False, foreground_threshold=240, background_threshold=10,
+                       erode_size=10, post_process_mask=False, batch_size=None, memory_budget_mb=None,
+                       disk_cache=None, progress=None):
+    """Remove the background from several PIL images, segmenting them in batches."""
+    from rembg.bg import get_concat_v_multi, post_process
+
+    segmented = segment_batch(images, session, batch_size, memory_budget_mb, disk_cache, progress)
+
+    _report(progress, "matting")
+    outputs = []
+    for index, (image, masks) in enumerate(segmented):
+        cutouts = []
+        for mask in masks:
+            if post_process_mask:
+                mask = Image.fromarray(post_process(np.array(mask)))
+            cutouts.append(cutout(image, mask, alpha_matting, foreground_threshold, background_threshold,
+                                  erode_size))
+        with profiling.stage("compositing"):
+            outputs.append(get_concat_v_multi(cutouts) if cutouts else image)
+        _report(progress, "matting", (index + 1) / len(segmented))
+
+    _report(progress, "compositing")
+    return outputs
+
+
+def remove_background(image, session, alpha_matting=False, foreground_threshold=240, background_threshold=10,
+                      erode_size=10, post_process_mask=False, mask_cache=None, disk_cache=None, progress=None):
+    """Remove the background from a PIL image, reporting each stage to progress(stage, fraction).
+
+    With a mask_cache, an image that was segmented before only goes through the matting step.
+    """
+    from rembg.bg import get_concat_v_multi, post_process
+
+    image, masks = segment(image, session, mask_cache, progress, disk_cache)
+
+    _report(progress, "matting")
+    cutouts = []
+    for index, mask in enumerate(masks):
+        if post_process_mask:
+            mask = Image.fromarray(post_process(np.array(mask)))
+        cutouts.append(cutout(image, mask, alpha_matting, foreground_threshold, background_threshold, erode_size))
+        _report(progress, "matting", (index + 1) / len(masks))
+
+    _report(progress, "compositing")
+    if not cutouts:
+        return image
+    with profiling.stage("compositing"):
+        return get_concat_v_multi(cutouts)
+
+
+def preview_matting(image, masks, foreground_threshold=240, background_threshold=10, erode_size=10,
+                    max_size=PREVIEW_MAX_SIZE):
+    """Alpha-matte a downscaled proxy of an already segmented image, fast enough to follow the sliders."""
+    from rembg.bg import get_concat_v_multi
+
+    ratio = min(1.0, max_size / max(image.size))
+    proxy_size = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+    proxy = image.resize(proxy_size, Image.BILINEAR)
+    # Keep the erosion the same size relative to the image
+    proxy_erode_size = max(1, round(erode_size * ratio)) if erode_size > 0 else 0
+
+    cutouts = [cutout(proxy, mask.resize(proxy_size, Image.BILINEAR), True, foreground_threshold,
+                      background_threshold, proxy_erode_size)
+               for mask in masks]
+    if not cutouts:
+        return proxy
+    return get_concat_v_multi(cutouts)
@@ -0,0 +1,377 @@
+"""CPU inference profiles that trade accuracy for speed.
+
+    quality   float32 models, ONNX Runtime's default session options, EDSR in eager PyTorch
+    balanced  float32 models, threads pinned to the physical cores, EDSR exported to ONNX
+    fast      like balanced, with int8 dynamically quantized segmentation and EDSR models
+
+Quantized and exported models are built once and kept next to the result cache,
+in <cache dir>/models. Building them needs the onnx package (for quantization) and
+onnxscript (for torch.onnx.export); without them a model falls back to what the
+"quality" profile runs, with a warning.
+
+Command line:
+    python profiles.py check [--images DIR] [--model u2net] [--scale 2] [--profiles quality,balanced,fast]
+
+The check reports, for each profile, the mask IoU and the upscaling PSNR against
+the float32 "quality" results, and the speedup over them.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import threading
+import warnings
+
+import numpy as np
+
+from disk_cache import default_cache_dir, package_version
+from sessions import DEFAULT_MODEL
+
+DEFAULT_PROFILE = "quality"
+
+# Thread count placeholder resolved to the number of physical cores when a session is built
+PHYSICAL_CORES = "physical"
+
+# Input size of the throwaway tensor EDSR is traced with; height and width stay dynamic
+EXPORT_SIZE = 64
+ONNX_OPSET = 17
+
+
+class InferenceProfile:
+    """ONNX Runtime session settings plus the precision and backend of each model."""
+
+    def __init__(self, name, graph_optimization="all", intra_op_threads=None, inter_op_threads=None,
+                 quantize_segmentation=False, upscaler_backend="torch"):
+        self.name = name
+        self.graph_optimization = graph_optimization
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.quantize_segmentation = quantize_segmentation
+        # "torch", "onnx" or "onnx-int8"
+        self.upscaler_backend = upscaler_backend
+
+    def __repr__(self):
+        return f"InferenceProfile({self.name!r})"
+
+
+PROFILES = {
+    "quality": InferenceProfile("quality"),
+    "balanced": InferenceProfile("balanced", intra_op_threads=PHYSICAL_CORES, inter_op_threads=1,
+                                 upscaler_backend="onnx"),
+    "fast": InferenceProfile("fast", intra_op_threads=PHYSICAL_CORES, inter_op_threads=1,
+                             quantize_segmentation=True, upscaler_backend="onnx-int8"),
+}
+
+
+def get_profile(profile=None):
+    """Return the InferenceProfile for a name (or the profile itself), defaulting to DEFAULT_PROFILE."""
+    if isinstance(profile, InferenceProfile):
+        return profile
+    try:
+        return PROFILES[profile or DEFAULT_PROFILE]
+    except KeyError:
+        raise ValueError(f"unknown inference profile {profile!r}, expected one of {', '.join(PROFILES)}") from None
+
+
+def physical_cores():
+    """Return the number of physical CPU cores, falling back to the logical count."""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    except ImportError:
+        pass
+    return os.cpu_count() or 1
+
+
+def models_dir():
+    return os.path.join(default_cache_dir(), "models")
+
+
+def session_options(profile=None, threads=None):
+    """Build ONNX Runtime session options for a profile. `threads` overrides its intra-op thread count."""
+    import onnxruntime as ort
+
+    profile = get_profile(profile)
+    levels = {
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    sess_opts = ort.SessionOptions()
+    sess_opts.graph_optimization_level = levels[profile.graph_optimization]
+
+    intra_op_threads = threads or profile.intra_op_threads
+    if intra_op_threads == PHYSICAL_CORES:
+        intra_op_threads = physical_cores()
+    if intra_op_threads:
+        sess_opts.intra_op_num_threads = intra_op_threads
+    if threads or profile.inter_op_threads:
+        # A single graph runs node after node, so extra inter-op threads only compete for the cores
+        sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        sess_opts.inter_op_num_threads = profile.inter_op_threads or 1
+    return sess_opts
+
+
+def _warn_fallback(error, what):
+    message = f"Cannot use {what} ({error!r}); using the float32 model of the \"quality\" profile instead."
+    if isinstance(error, ImportError):
+        message += " Install onnx and onnxscript (pip install onnx onnxscript) for the balanced and fast profiles."
+    warnings.warn(message, RuntimeWarning, stacklevel=3)
+
+
+def _source_digest(*parts):
+    return hashlib.blake2b(":".join(str(part) for part in parts).encode(), digest_size=8).hexdigest()
+
+
+_build_lock = threading.Lock()
+
+
+def _build_once(target, build):
+    """Run build(temp_path) unless target exists, then move the result into place."""
+    with _build_lock:
+        if not os.path.isfile(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Other processes may be building the same file, so write under a private name first
+            temp_path = f"{target}.{os.getpid()}.part.onnx"
+            try:
+                build(temp_path)
+                os.replace(temp_path, target)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    return target
+
+
+def quantize_model(source_path, name):
+    """Return the path of an int8 dynamically quantized copy of an ONNX model, creating it on first use.
+
+    Returns None, after a warning, when the quantization tools are not installed or fail.
+    """
+    stat = os.stat(source_path)
+    digest = _source_digest(os.path.abspath(source_path), stat.st_size, int(stat.st_mtime),
+                            package_version("onnxruntime"))
+    target = os.path.join(models_dir(), f"{name}-{digest}-int8.onnx")
+
+    def build(temp_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(source_path, temp_path, weight_type=QuantType.QUInt8)
+
+    try:
+        return _build_once(target, build)
+    except Exception as e:
+        _warn_fallback(e, f"the int8 {name} model")
+        return None
+
+
+def new_session(model_name=DEFAULT_MODEL, profile=None, threads=None):
+    """Create a rembg session that runs with a profile's session options and precision."""
+    import onnxruntime as ort
+    from rembg import new_session as new_rembg_session
+
+    profile = get_profile(profile)
+    sess_opts = session_options(profile, threads)
+    session = new_rembg_session(model_name, sess_opts=sess_opts)
+    if profile.quantize_segmentation:
+        # rembg only knows the float32 files, so swap the quantized graph in underneath it
+        model_path = quantize_model(session.inner_session._model_path, model_name)
+        if model_path:
+            try:
+                inner_session = ort.InferenceSession(model_path, sess_options=sess_opts,
+                                                     providers=["CPUExecutionProvider"])
+            except Exception as e:
+                # Usually a damaged cached file, which is quantized again once deleted
+                _warn_fallback(e, model_path)
+                return session
+            session.inner_session = inner_session
+            # Masks from a quantized network differ, so they are cached apart from float32 ones
+            session.variant = "int8"
+    return session
+
+
+class OnnxEdsrModel:
+    """An EDSR model exported to ONNX, called like the PyTorch module it replaces."""
+
+    # The session already runs one thread per physical core and torch.set_num_threads cannot
+    # lower that, so running several tiles through it at once would oversubscribe the CPU
+    parallel_tiles = False
+
+    def __init__(self, model_path, config, sess_opts, variant):
+        import onnxruntime as ort
+
+        self.config = config
+        self.variant = variant
+        self.session = ort.InferenceSession(model_path, sess_options=sess_opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, inputs):
+        import torch
+
+        outputs = self.session.run(None, {self.input_name: inputs.numpy()})[0]
+        return torch.from_numpy(outputs)
+
+
+def export_upscaler(model, quantize=False):
+    """Return the path of an ONNX export of an EDSR model, int8 quantized if asked, creating it on first use.
+
+    Returns None, after a warning, when the export or quantization tools are not installed or fail.
+    """
+    import torch
+
+    name = (getattr(model.config, "name_or_path", "") or "edsr").rstrip("/").split("/")[-1]
+    scale = model.config.scale
+    # Checksum the weights rather than trusting the source path, which may be a hub id
+    weights = hashlib.blake2b(digest_size=8)
+    for tensor in model.state_dict().values():
+        weights.update(tensor.detach().cpu().numpy().tobytes())
+    digest = _source_digest(weights.hexdigest(), package_version("torch"))
+    target = os.path.join(models_dir(), f"{name}-{scale}x-{digest}.onnx")
+
+    def build(temp_path):
+        inputs = torch.zeros(1, 3, EXPORT_SIZE, EXPORT_SIZE)
+        with torch.no_grad():
+            torch.onnx.export(model, inputs, temp_path, input_names=["input"], output_names=["output"],
+                              dynamic_axes={"input": {2: "height", 3: "width"}, "output": {2: "height", 3: "width"}},
+                              opset_version=ONNX_OPSET)
+
+    try:
+        _build_once(target, build)
+    except Exception as e:
+        _warn_fallback(e, f"the ONNX export of {name} {scale}x")
+        return None
+    if quantize:
+        return quantize_model(target, f"{name}-{scale}x")
+    return target
+
+
+def prepare_upscaler(model, profile=None, threads=None):
+    """Return the EDSR model to run under a profile: the PyTorch module itself or its ONNX export."""
+    profile = get_profile(profile)
+    if profile.upscaler_backend == "torch":
+        return model
+    model_path = export_upscaler(model, quantize=profile.upscaler_backend == "onnx-int8")
+    if model_path is None:
+        return model
+    try:
+        return OnnxEdsrModel(model_path, model.config, session_options(profile, threads), profile.upscaler_backend)
+    except Exception as e:
+        _warn_fallback(e, model_path)
+        return model
+
+
+def mask_iou(mask, reference, threshold=128):
+    """Intersection over union of two L masks, thresholded to foreground and background."""
+    a = np.asarray(mask) >= threshold
+    b = np.asarray(reference) >= threshold
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def psnr(image, reference):
+    """Peak signal-to-noise ratio in dB of an 8-bit RGB image against a reference."""
+    difference = np.asarray(image.convert("RGB"), dtype=np.float64) - np.asarray(reference.convert("RGB"),
+                                                                                   dtype=np.float64)
+    mse = np.mean(difference ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+
+def synthetic_images(count=4, width=640, height=480):
+    """Noisy backgrounds with a bright ellipse in the middle, for checking without sample files."""
+    from benchmarks._common import synthetic_image
+
+    return [synthetic_image(width, height, seed=index) for index in range(count)]
+
+
+def check_profiles(images, model_name=DEFAULT_MODEL, scale=2, profiles=tuple(PROFILES), weights_dir=None,
+                   upscale_size=256, repeat=3):
+    """Run every profile on the same images and compare it with the float32 "quality" profile.
+
+    Returns one dict per profile with seconds per image for segmentation and upscaling,
+    the speedup of each over the reference, the mean and worst mask IoU and the mean and
+    worst upscaling PSNR. Upscaling runs on copies no larger than upscale_size.
+    """
+    from PIL import Image
+
+    from benchmarks._common import timed
+    from upscaler import EdsrModelRegistry, upscale
+
+    small_images = []
+    for image in images:
+        small = image.convert("RGB")
+        small.thumbnail((upscale_size, upscale_size), Image.LANCZOS)
+        small_images.append(small)
+
+    results = {}
+    for name in ["quality"] + [name for name in profiles if name != "quality"]:
+        session = new_session(model_name, name)
+        model = EdsrModelRegistry(weights_dir=weights_dir, profile=name).get(scale)
+        # Warm up, so no profile pays for ONNX Runtime's or torch's first-run allocations
+        session.predict(images[0])
+        upscale(small_images[0], model)
+
+        segment_time, masks = timed(lambda: [session.predict(image)[0] for image in images], repeat)
+        upscale_time, upscaled = timed(lambda: [upscale(image, model) for image in small_images], repeat)
+        results[name] = {"segment": segment_time / len(images), "upscale": upscale_time / len(images),
+                         "masks": masks, "upscaled": upscaled}
+
+    reference = results["quality"]
+    report = []
+    for name in profiles:
+        result = results[name]
+        ious = [mask_iou(mask, expected) for mask, expected in zip(result["masks"], reference["masks"])]
+        psnrs = [psnr(image, expected) for image, expected in zip(result["upscaled"], reference["upscaled"])]
+        report.append({
+            "profile": name,
+            "segment_seconds": result["segment"],
+            "segment_speedup": reference["segment"] / result["segment"],
+            "upscale_seconds": result["upscale"],
+            "upscale_speedup": reference["upscale"] / result["upscale"],
+            "mask_iou": float(np.mean(ious)),
+            "min_mask_iou": min(ious),
+            "psnr": float(np.mean(psnrs)),
+            "min_psnr": min(psnrs),
+        })
+    return report
+
+
+def _load_images(directory):
+    from PIL import Image
+
+    paths = sorted(path for path in glob.glob(os.path.join(directory, "*"))
+                   if path.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+    return [Image.open(path).convert("RGB") for path in paths]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the speed and accuracy of the inference profiles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check", help="measure every profile against the float32 reference")
+    check.add_argument("--images", help="folder of test images (default: synthetic images)")
+    check.add_argument("--model", default=DEFAULT_MODEL, help="rembg segmentation model")
+    check.add_argument("--scale", type=int, choices=(2, 3, 4), default=2, help="super-resolution factor")
+    check.add_argument("--profiles", default=",".join(PROFILES), help="comma separated profiles to check")
+    check.add_argument("--weights-dir", help="local EDSR weights, for machines without network access")
+    check.add_argument("--repeat", type=int, default=3, help="runs per profile, the fastest is kept")
+    args = parser.parse_args(argv)
+
+    images = _load_images(args.images) if args.images else synthetic_images()
+    if not images:
+        print("No images found.", file=sys.stderr)
+        return 1
+    profiles = [get_profile(name.strip()).name for name in args.profiles.split(",")]
+
+    print(f"{args.model} and {args.scale}x EDSR, {len(images)} image(s), {physical_cores()} physical core(s)")
+    print(f"  {'profile':<10} {'segment':>10} {'speedup':>8} {'mask IoU':>9} {'upscale':>10} {'speedup':>8} "
+          f"{'PSNR dB':>8}")
+    for row in check_profiles(images, args.model, args.scale, profiles, args.weights_dir, repeat=args.repeat):
+        print(f"  {row['profile']:<10} {row['segment_seconds'] * 1000:8.1f}ms {row['segment_speedup']:7.2f}x "
+              f"{row['mask_iou']:9.4f} {row['upscale_seconds'] * 1000:8.1f}ms {row['upscale_speedup']:7.2f}x "
+              f"{row['psnr']:8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,237 @@
+"""Stage timing and memory instrumentation for the processing pipeline.
+
+    profiling.enable()
+    with profiling.stage("inference", model="u2net"):
+        masks = session.predict(image)
+        profiling.annotate(input_shape=[1, 3, 320, 320])
+    profiling.get_profiler().save("trace.json")
+
+Each stage records its wall time, the resident memory before and after it, the
+process's peak resident memory so far and any annotations, such as tensor shapes.
+A .json path is written as a Chrome trace (open it in chrome://tracing or
+https://ui.perfetto.dev); a .jsonl path gets one JSON record per stage.
+
+While profiling is disabled, stage() returns a shared context manager that does
+nothing and annotate() returns at once, so instrumented code pays one function
+call per stage.
+"""
+import json
+import os
+import threading
+import time
+
+# A plain module import, since image_io is itself instrumented and imports this module
+import image_io
+
+# Environment variable that turns profiling on: a trace file to write on exit, or 1
+TRACE_ENV = "BGXUP_TRACE"
+
+# Category of the pipeline stages; finer-grained events, such as single tiles, use their own
+STAGE = "stage"
+
+_profiler = None
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "category", "args", "event")
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+        self.event = None
+
+    def __enter__(self):
+        self.event = self.profiler.begin(self.name, self.category, self.args)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.end(self.event, failed=exc_type is not None)
+        return False
+
+
+class Profiler:
+    """Collects timed stage events from every thread of a process."""
+
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def begin(self, name, category=STAGE, args=None):
+        stack = self._stack()
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "pid": self.pid,
+            "tid": thread.ident,
+            "thread": thread.name,
+            "depth": len(stack),
+            "args": dict(args or {}),
+            "rss_before": image_io.memory_usage(),
+            "start": time.perf_counter(),
+        }
+        stack.append(event)
+        return event
+
+    def end(self, event, failed=False):
+        event["seconds"] = time.perf_counter() - event["start"]
+        event["rss_after"] = image_io.memory_usage()
+        event["peak_rss"] = image_io.peak_memory_usage()
+        if failed:
+            event["args"]["failed"] = True
+        stack = self._stack()
+        if stack and stack[-1] is event:
+            stack.pop()
+        with self._lock:
+            self.events.append(event)
+
+    def annotate(self, **args):
+        """Attach values, such as tensor shapes, to the innermost open stage of this thread."""
+        stack = self._stack()
+        if stack:
+            stack[-1]["args"].update(args)
+
+    def mark(self):
+        """Return a position in the event list, for summarizing only what happens after it."""
+        with self._lock:
+            return len(self.events)
+
+    def drain(self):
+        """Remove and return the finished events, e.g. to send them to another process."""
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def add_events(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    def summary(self, since=0, category=STAGE):
+        """Return {stage: {"count", "seconds", "peak_rss"}} for events of a category, slowest first."""
+        with self._lock:
+            events = self.events[since:]
+        totals = {}
+        for event in events:
+            if category is not None and event["cat"] != category:
+                continue
+            total = totals.setdefault(event["name"], {"count": 0, "seconds": 0.0, "peak_rss": None})
+            total["count"] += 1
+            total["seconds"] += event["seconds"]
+            if event["peak_rss"] is not None:
+                total["peak_rss"] = max(total["peak_rss"] or 0, event["peak_rss"])
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["seconds"]))
+
+    def chrome_trace(self):
+        """Return the events in the Chrome trace event format."""
+        with self._lock:
+            events = list(self.events)
+        trace = []
+        threads = {}
+        for event in events:
+            threads[(event["pid"], event["tid"])] = event["thread"]
+            args = dict(event["args"])
+            for name in ("rss_before", "rss_after", "peak_rss"):
+                if event[name] is not None:
+                    args[name] = event[name]
+            trace.append({
+                "name": event["name"],
+                "cat": event["cat"],
+                "ph": "X",
+                "ts": round(event["start"] * 1e6, 3),
+                "dur": round(event["seconds"] * 1e6, 3),
+                "pid": event["pid"],
+                "tid": event["tid"],
+                "args": args,
+            })
+        for (pid, tid), name in threads.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        """Write a Chrome trace, or one JSON record per stage if the path ends in .jsonl."""
+        with open(path, "w") as output:
+            if path.lower().endswith(".jsonl"):
+                with self._lock:
+                    events = list(self.events)
+                for event in events:
+                    output.write(json.dumps(event, default=str) + "\n")
+            else:
+                json.dump(self.chrome_trace(), output, default=str)
+
+
+def enable(profiler=None):
+    """Start recording stages into a profiler, a new one unless given, and return it."""
+    global _profiler
+    _profiler = profiler or Profiler()
+    return _profiler
+
+
+def disable():
+    """Stop recording and return the profiler that was active, if any."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def enabled():
+    return _profiler is not None
+
+
+def get_profiler():
+    return _profiler
+
+
+def enable_from_environment():
+    """Enable profiling if BGXUP_TRACE is set, returning the trace path to write (None for "1")."""
+    value = os.environ.get(TRACE_ENV, "")
+    if value in ("", "0"):
+        return None
+    enable()
+    return None if value == "1" else value
+
+
+def stage(name, category=STAGE, **args):
+    """Return a context manager timing one stage, or a do-nothing one while profiling is disabled."""
+    if _profiler is None:
+        return _NULL_STAGE
+    return _Stage(_profiler, name, category, args)
+
+
+def annotate(**args):
+    """Attach values to the current stage while profiling is enabled."""
+    if _profiler is not None:
+        _profiler.annotate(**args)
+
+
+def format_summary(summary, limit=4):
+    """Describe the slowest stages of a summary in one line, for a status bar."""
+    from disk_cache import format_bytes
+
+    parts = [f"{name} {total['seconds']:.2f}s" for name, total in list(summary.items())[:limit]]
+    peaks = [total["peak_rss"] for total in summary.values() if total["peak_rss"] is not None]
+    if peaks:
+        parts.append(f"peak {format_bytes(max(peaks))}")
+    return ", ".join(parts)
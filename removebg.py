@@ -1,12 +1,65 @@
 import customtkinter
+import tkinter
 from tkinter import filedialog, messagebox, colorchooser
 from PIL import Image, ImageTk
-from rembg import remove
+import importlib
 import os
+import threading
+
+import profiling
+from disk_cache import DiskCache, format_bytes
+from export import DEFAULT_PRESET, PRESETS as EXPORT_PRESETS, encoder_options, export_many, format_for_path, \
+    output_paths, save_image as write_image
+from image_io import LazyImage, memory_usage
+from jobs import JobExecutor
+from pipeline import REMOVE_STAGES, MaskCache, preview_matting, remove_background, remove_backgrounds, \
+    segmentation_batch_size
+from profiles import DEFAULT_PROFILE, PROFILES, new_session
+from sessions import RembgSessionManager, DEFAULT_MODEL
+from upscaler import UPSCALE_STAGES, EdsrModelRegistry, auto_workers, upscale
+
+# Upscaling menu entries and the EDSR scale each one uses
+UPSCALE_OPTIONS = {
+    "2x Super-Resolution Upscaling": 2,
+    "3x Super-Resolution Upscaling": 3,
+    "4x Super-Resolution Upscaling": 4,
+}
+
+# Inference libraries that are slow to import. They are loaded in the background
+# once the window is up instead of delaying startup.
+INFERENCE_MODULES = ("rembg.bg", "torch", "super_image")
+
+# The slider redraws at most this many times per second while dragging
+SLIDER_REFRESH_RATE = 60
+
+# Milliseconds without a resize before the slider redraws at full quality
+RESIZE_DEBOUNCE_MS = 150
+
+
+class PreviewPyramid:
+    """Successively halved copies of an image, so previews are resampled from the smallest adequate level."""
+
+    MIN_SIZE = 64
+
+    def __init__(self, image):
+        self.image = image
+        self.levels = [image]
+        level = image
+        while min(level.size) // 2 >= self.MIN_SIZE:
+            # BOX resampling of an exact half is a plain 2x2 average (premultiplied for RGBA)
+            level = level.resize((level.width // 2, level.height // 2), Image.BOX)
+            self.levels.append(level)
+
+    def resized(self, size, resample):
+        """Resize to the given size from the smallest level that is still at least that large."""
+        source = self.levels[0]
+        for level in self.levels:
+            if level.width >= size[0] and level.height >= size[1]:
+                source = level
+        if source.size == size:
+            return source
+        return source.resize(size, resample)
 
-# Import the super-image library and torch for upscaling
-from super_image import EdsrModel, ImageLoader
-import torch
 
 # Set the appearance mode and default color theme
 customtkinter.set_appearance_mode("dark")
@@ -25,17 +78,38 @@ class BeforeAfterSliderFrame(customtkinter.CTkFrame):
 
         self.image1_pil = None
         self.image2_pil = None
+        # Solid color shown behind the transparent parts of the processed image
+        self.background2 = None
         self.separator_pos = self.width / 2
 
         # A strong reference to the image objects to prevent garbage collection
         self.canvas.original_photo_image = None
         self.canvas.processed_photo_image = None
 
-        # Store resized PIL images for cropping
+        # Store resized PIL images for their display size
         self.resized_image1_pil = None
         self.resized_image2_pil = None
-        self.canvas.cropped_original_photo_image = None
-        self.canvas.cropped_processed_photo_image = None
+
+        # Preview pyramids and the last resize of each side, reused while the source is unchanged
+        self._pyramids = {}
+        self._previews = {}
+        self._final_resize_job = None
+
+        # The visible part of each side is copied into these on every redraw.
+        # They and the canvas items showing them live as long as the frame does.
+        self.canvas.processed_view = tkinter.PhotoImage(master=self.canvas)
+        self.canvas.original_view = tkinter.PhotoImage(master=self.canvas)
+        self.processed_item = self.canvas.create_image(0, 0, anchor="nw", image=self.canvas.processed_view,
+                                                       state="hidden")
+        self.original_item = self.canvas.create_image(0, 0, anchor="nw", image=self.canvas.original_view,
+                                                      state="hidden")
+        self.separator_item = self.canvas.create_line(self.separator_pos, 0, self.separator_pos, self.height,
+                                                      fill="white", width=2)
+
+        # Drag events arrive much faster than the screen refreshes, so redraws are batched
+        self.frame_interval = max(1, int(1000 / SLIDER_REFRESH_RATE))
+        self._redraw_pending = False
+        self._drawn_split = None
 
         self.canvas.bind("<ButtonPress-1>", self._on_press)
         self.canvas.bind("<B1-Motion>", self._on_drag)
@@ -43,15 +117,26 @@ class BeforeAfterSliderFrame(customtkinter.CTkFrame):
 
     def _on_configure(self, event):
         """Handle window resize and re-draw the images."""
+        if (event.width, event.height) == (self.width, self.height):
+            return
         self.width = event.width
         self.height = event.height
         self.canvas.configure(width=self.width, height=self.height)
-        self.show_images(self.image1_pil, self.image2_pil)
+
+        # Draw a quick preview now and the high-quality one once resizing stops
+        self._refresh(final=False)
+        if self._final_resize_job is not None:
+            self.after_cancel(self._final_resize_job)
+        self._final_resize_job = self.after(RESIZE_DEBOUNCE_MS, self._finish_resize)
+
+    def _finish_resize(self):
+        self._final_resize_job = None
+        self._refresh(final=True)
 
     def _on_press(self, event):
         """Handle mouse press event on the canvas."""
         self.separator_pos = event.x
-        self._redraw_images()
+        self._schedule_redraw()
 
     def _on_drag(self, event):
         """Handle mouse drag event on the canvas."""
@@ -71,84 +156,118 @@ class BeforeAfterSliderFrame(customtkinter.CTkFrame):
             elif self.separator_pos > self.width:
                 self.separator_pos = self.width
 
-        self._redraw_images()
+        self._schedule_redraw()
+
+    def _schedule_redraw(self):
+        """Redraw on the next frame, folding together all events that arrive before it."""
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after(self.frame_interval, self._redraw_images)
+
+    def _show_region(self, item, view, photo_image, x_start, x_end, image_height, canvas_x):
+        """Copy columns [x_start, x_end) of a photo image into a view and place its item on the canvas."""
+        if x_end <= x_start:
+            self.canvas.itemconfigure(item, state="hidden")
+            return
+        # A native Tk copy into the existing photo. -shrink trims it to exactly the copied region and
+        # "set" replaces the old pixels instead of blending the new ones over them.
+        view.tk.call(view, "copy", photo_image, "-from", x_start, 0, x_end, image_height, "-to", 0, 0, "-shrink",
+                     "-compositingrule", "set")
+        self.canvas.coords(item, canvas_x, (self.height - image_height) / 2)
+        self.canvas.itemconfigure(item, state="normal")
 
     def _redraw_images(self):
         """Redraw the images and the separator line on the canvas."""
-        self.canvas.delete("all")
+        self._redraw_pending = False
 
         if self.resized_image1_pil and self.resized_image2_pil:
             img_width = self.resized_image1_pil.width
-            img_height = self.resized_image2_pil.height
 
             # Calculate image position on canvas
             image_x_offset = (self.width - img_width) / 2
-
-            # Draw the left (processed) side
-            crop_right = min(img_width, int(self.separator_pos - image_x_offset))
-            if crop_right > 0:
-                cropped_image2 = self.resized_image2_pil.crop((0, 0, crop_right, img_height))
-                cropped_photo_image2 = ImageTk.PhotoImage(cropped_image2)
-                self.canvas.create_image(self.separator_pos, self.height / 2, anchor="e", image=cropped_photo_image2)
-                self.canvas.cropped_processed_photo_image = cropped_photo_image2
-
-            # Draw the right (original) side
-            crop_left = max(0, int(self.separator_pos - image_x_offset))
-            if crop_left < img_width:
-                cropped_image1 = self.resized_image1_pil.crop((crop_left, 0, img_width, img_height))
-                cropped_photo_image1 = ImageTk.PhotoImage(cropped_image1)
-                self.canvas.create_image(self.separator_pos, self.height / 2, anchor="w", image=cropped_photo_image1)
-                self.canvas.cropped_original_photo_image = cropped_photo_image1
+            split = max(0, min(img_width, int(self.separator_pos - image_x_offset)))
+
+            if split != self._drawn_split:
+                # Draw the left (processed) side
+                self._show_region(self.processed_item, self.canvas.processed_view,
+                                  self.canvas.processed_photo_image, 0, min(split, self.resized_image2_pil.width),
+                                  self.resized_image2_pil.height, image_x_offset)
+
+                # Draw the right (original) side
+                self._show_region(self.original_item, self.canvas.original_view,
+                                  self.canvas.original_photo_image, split, img_width,
+                                  self.resized_image1_pil.height, image_x_offset + split)
+                self._drawn_split = split
         elif self.resized_image1_pil:
             # Draw only the original image if no processed image is available
-            self.canvas.create_image(self.width / 2, self.height / 2, anchor="center",
-                                     image=self.canvas.original_photo_image)
-
-        # Draw the vertical line for the slider
-        self.canvas.create_line(self.separator_pos, 0, self.separator_pos, self.height, fill="white", width=2)
-
-    def show_images(self, pil_image1, pil_image2=None):
-        """Load and display the before and after images."""
-        self.canvas.delete("all")
-
-        # Explicitly clear all previous image references
-        self.image1_pil = None
-        self.image2_pil = None
-        self.resized_image1_pil = None
-        self.resized_image2_pil = None
-        self.canvas.original_photo_image = None
-        self.canvas.processed_photo_image = None
-        self.canvas.cropped_original_photo_image = None
-        self.canvas.cropped_processed_photo_image = None
-
-        self.image1_pil = pil_image1
-        self.image2_pil = pil_image2
-
-        # Resize images to fit canvas
-        def resize_image(pil_img):
+            if self._drawn_split is None:
+                img_width = self.resized_image1_pil.width
+                self.canvas.itemconfigure(self.processed_item, state="hidden")
+                self._show_region(self.original_item, self.canvas.original_view,
+                                  self.canvas.original_photo_image, 0, img_width,
+                                  self.resized_image1_pil.height, (self.width - img_width) / 2)
+                self._drawn_split = img_width
+        else:
+            self.canvas.itemconfigure(self.processed_item, state="hidden")
+            self.canvas.itemconfigure(self.original_item, state="hidden")
+
+        # Move the vertical line for the slider
+        self.canvas.coords(self.separator_item, self.separator_pos, 0, self.separator_pos, self.height)
+
+    def _preview(self, slot, pil_img, final, background=None):
+        """Return the display-size copy of an image and its PhotoImage, resampling only when needed.
+
+        A background color is composited under the resized copy, which costs a fraction of
+        compositing the full-resolution image and gives the same picture.
+        """
+        if not pil_img:
+            return None, None
+        img_width, img_height = pil_img.size
+        ratio = min(self.width / img_width, self.height / img_height)
+        new_size = (int(img_width * ratio), int(img_height * ratio))
+        if new_size[0] == 0 or new_size[1] == 0:
+            return None, None
+
+        cached = self._previews.get(slot)
+        if cached and cached[0] is pil_img and cached[1] == new_size and (cached[2] or not final) \
+                and cached[5] == background:
+            return cached[3], cached[4]
+
+        pyramid = self._pyramids.get(slot)
+        if pyramid is None or pyramid.image is not pil_img:
+            pyramid = PreviewPyramid(pil_img)
+            self._pyramids[slot] = pyramid
+
+        resized_img = pyramid.resized(new_size, Image.LANCZOS if final else Image.BILINEAR)
+        if background and resized_img.mode == "RGBA":
+            resized_img = Image.alpha_composite(Image.new("RGBA", resized_img.size, background), resized_img)
+        photo_image = ImageTk.PhotoImage(resized_img)
+        self._previews[slot] = (pil_img, new_size, final, resized_img, photo_image, background)
+        return resized_img, photo_image
+
+    def _refresh(self, final=True):
+        """Fit the current images to the canvas and redraw them."""
+        self.resized_image1_pil, self.canvas.original_photo_image = self._preview("original", self.image1_pil, final)
+        self.resized_image2_pil, self.canvas.processed_photo_image = self._preview("processed", self.image2_pil, final,
+                                                                                  self.background2)
+
+        # Forget sides that are no longer shown so their images can be freed
+        for slot, pil_img in (("original", self.image1_pil), ("processed", self.image2_pil)):
             if not pil_img:
-                return None
-            img_width, img_height = pil_img.size
-            ratio = min(self.width / img_width, self.height / img_height)
-            new_size = (int(img_width * ratio), int(img_height * ratio))
-            if new_size[0] == 0 or new_size[1] == 0:
-                return None
-            resized_img = pil_img.resize(new_size, Image.LANCZOS)
-            return resized_img
-
-        self.resized_image1_pil = resize_image(pil_image1)
-        self.resized_image2_pil = resize_image(pil_image2)
-
-        # Convert to CTkImage and store references
-        if self.resized_image1_pil:
-            self.canvas.original_photo_image = ImageTk.PhotoImage(self.resized_image1_pil)
-        if self.resized_image2_pil:
-            self.canvas.processed_photo_image = ImageTk.PhotoImage(self.resized_image2_pil)
+                self._pyramids.pop(slot, None)
+                self._previews.pop(slot, None)
 
         self.separator_pos = self.width / 2
-
+        self._drawn_split = None
         self._redraw_images()
 
+    def show_images(self, pil_image1, pil_image2=None, background=None):
+        """Load and display the before and after images, the after image over an optional background color."""
+        self.image1_pil = pil_image1
+        self.image2_pil = pil_image2
+        self.background2 = background
+        self._refresh(final=True)
+
 
 class AdvancedBackgroundRemoverApp(customtkinter.CTk):
     def __init__(self):
@@ -160,10 +279,29 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         self.resizable(True, True)
 
         self.input_file_path = None
-        self.input_image_pil = None
+        self.input_image = None
+        self.input_preview = None
         self.current_processed_image_transparent = None
-        self.final_image_to_save = None
+        self.upscale_source_image = None
         self.background_color = None
+        # The processed image over the background color, built when first saved: (image, color, result)
+        self._composited = None
+
+        # Warm rembg sessions shared by every background removal, and warm EDSR models,
+        # one per upscaling factor, both set up for the selected inference profile
+        self.profile = DEFAULT_PROFILE
+        self._create_models()
+
+        # Runs removal and upscaling off the Tk main thread
+        self.jobs = JobExecutor(self)
+        # Encodes saved files, on a worker of its own so saving never waits for an upscale
+        self.exports = JobExecutor(self)
+
+        # Segmentation masks of recent images, so changing matting settings skips the network
+        self.mask_cache = MaskCache()
+
+        # Masks and upscaled results from earlier runs, keyed by image content
+        self.disk_cache = DiskCache() if os.environ.get("BGXUP_CACHE", "1") != "0" else None
 
         # Create main frame
         self.main_frame = customtkinter.CTkFrame(self)
@@ -172,6 +310,10 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         # Create and place widgets
         self.create_widgets()
 
+        # Start importing the inference libraries once the first frame has been drawn
+        if os.environ.get("BGXUP_PRELOAD", "1") != "0":
+            self.after(500, self._start_background_imports)
+
     def create_widgets(self):
         """Creates all the widgets for the application's GUI."""
         # Header Label
@@ -193,6 +335,13 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         )
         browse_button.pack(side="left", padx=10)
 
+        batch_button = customtkinter.CTkButton(
+            action_frame,
+            text="Batch Remove...",
+            command=self.batch_remove_backgrounds
+        )
+        batch_button.pack(side="left", padx=10)
+
         self.remove_bg_button = customtkinter.CTkButton(
             action_frame,
             text="Remove Background",
@@ -201,15 +350,35 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         )
         self.remove_bg_button.pack(side="left", padx=10)
 
+        # Segmentation model used for background removal
+        self.rembg_model_menu = customtkinter.CTkOptionMenu(
+            action_frame,
+            values=[DEFAULT_MODEL, "u2netp", "isnet-general-use", "silueta"]
+        )
+        self.rembg_model_menu.set(DEFAULT_MODEL)
+        self.rembg_model_menu.pack(side="left", padx=10)
+
+        # Inference profile: float32 quality, thread-tuned balanced or int8 fast
+        self.profile_menu = customtkinter.CTkOptionMenu(
+            action_frame,
+            values=list(PROFILES),
+            command=self.change_profile
+        )
+        self.profile_menu.set(self.profile)
+        self.profile_menu.pack(side="left", padx=10)
+
         # Upscaling options with clearer labels
         self.upscale_option_menu = customtkinter.CTkOptionMenu(
             action_frame,
-            values=["No Upscaling", "2x Super-Resolution Upscaling"],
+            values=["No Upscaling"] + list(UPSCALE_OPTIONS),
             command=self.upscale_image,
             state="disabled"
         )
         self.upscale_option_menu.pack(side="left", padx=10)
 
+        self.upscaler_status_label = customtkinter.CTkLabel(action_frame, text="", text_color="gray")
+        self.upscaler_status_label.pack(side="left", padx=10)
+
         self.save_button = customtkinter.CTkButton(
             action_frame,
             text="Save Processed Image",
@@ -218,6 +387,14 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         )
         self.save_button.pack(side="left", padx=10)
 
+        self.export_all_button = customtkinter.CTkButton(
+            action_frame,
+            text="Export All Formats...",
+            command=self.export_all_formats,
+            state="disabled"
+        )
+        self.export_all_button.pack(side="left", padx=10)
+
         # Options and color preview frame
         options_frame = customtkinter.CTkFrame(self.main_frame, fg_color="transparent")
         options_frame.pack(pady=10, padx=10)
@@ -237,6 +414,13 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         self.color_preview.pack(side="left", padx=(0, 20))
         self.color_preview_rect = self.color_preview.create_rectangle(0, 0, 20, 20, fill="", outline="")
 
+        # Encoder settings for saved files: Pillow's defaults, faster, smaller or higher fidelity
+        export_preset_label = customtkinter.CTkLabel(options_frame, text="Export:")
+        export_preset_label.pack(side="left", padx=(0, 5))
+        self.export_preset_menu = customtkinter.CTkOptionMenu(options_frame, values=list(EXPORT_PRESETS))
+        self.export_preset_menu.set(DEFAULT_PRESET)
+        self.export_preset_menu.pack(side="left", padx=(0, 20))
+
         # New frame for advanced background removal options
         advanced_options_frame = customtkinter.CTkFrame(self.main_frame)
         advanced_options_frame.pack(pady=10, padx=10, fill="x")
@@ -291,48 +475,143 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         )
         self.status_label.pack(pady=(5, 10))
 
-        self.progress_bar = customtkinter.CTkProgressBar(self.main_frame, width=300)
+        self.progress_frame = customtkinter.CTkFrame(self.main_frame, fg_color="transparent")
+
+        self.progress_bar = customtkinter.CTkProgressBar(self.progress_frame, width=300, mode="determinate")
         self.progress_bar.set(0)
-        self.progress_bar.pack(pady=(0, 10))
-        self.progress_bar.pack_forget()
+        self.progress_bar.pack(side="left", padx=10)
+
+        self.cancel_button = customtkinter.CTkButton(
+            self.progress_frame,
+            text="Cancel",
+            width=80,
+            command=self.cancel_processing
+        )
+        self.cancel_button.pack(side="left", padx=10)
 
         # Image preview frame, now a single slider frame
         self.slider_frame = BeforeAfterSliderFrame(self.main_frame, width=800, height=600)
         self.slider_frame.pack(fill="both", expand=True, padx=10, pady=10)
 
+    def _create_models(self):
+        profile = self.profile
+        self.session_manager = RembgSessionManager(
+            session_factory=lambda model_name: new_session(model_name, profile))
+        self.model_registry = EdsrModelRegistry(profile=profile)
+
+    def change_profile(self, profile):
+        """Switches the inference profile, dropping the models and masks of the previous one."""
+        if profile == self.profile:
+            return
+        self.jobs.cancel()
+        self.profile = profile
+        self._create_models()
+        # Masks from another precision are not reused for matting previews
+        self.mask_cache.clear()
+        self.upscaler_status_label.configure(text="")
+        if self.input_image:
+            self.preload_upscaler(UPSCALE_OPTIONS["2x Super-Resolution Upscaling"])
+        self.status_label.configure(text=f"Inference profile: {profile}", text_color="gray")
+
+    def _start_background_imports(self):
+        """Imports the inference libraries on a background thread so the first action starts sooner."""
+
+        def import_modules():
+            for module_name in INFERENCE_MODULES:
+                try:
+                    importlib.import_module(module_name)
+                except Exception:
+                    # The real error surfaces when the user runs that action
+                    pass
+
+        threading.Thread(target=import_modules, daemon=True).start()
+
     def toggle_alpha_matting_options(self):
         """Show or hide the alpha matting sliders based on checkbox state."""
         if self.alpha_matting_var.get() == "on":
             self.alpha_matting_frame.pack(pady=10, padx=10, fill="x")
+            self.preview_alpha_matting()
         else:
             self.alpha_matting_frame.pack_forget()
 
     def update_fg_threshold_label(self, value):
         self.foreground_threshold_label.configure(text=f"Foreground Threshold: {int(value)}")
+        self.preview_alpha_matting()
 
     def update_bg_threshold_label(self, value):
         self.background_threshold_label.configure(text=f"Background Threshold: {int(value)}")
+        self.preview_alpha_matting()
 
     def update_erode_size_label(self, value):
         self.erode_size_label.configure(text=f"Erode Size: {int(value)}")
+        self.preview_alpha_matting()
+
+    def preview_alpha_matting(self):
+        """Shows the alpha matting settings applied to a small proxy of the already segmented image."""
+        if self.alpha_matting_var.get() != "on" or not self.input_image or self.input_image.decoded is None:
+            return
+
+        # Previews only re-run matting, so they need a mask from an earlier removal
+        cached = self.mask_cache.get(self.input_image.decoded, self.rembg_model_menu.get())
+        if cached is None:
+            return
+        oriented_image, masks = cached
+
+        foreground_threshold = int(self.foreground_threshold_slider.get())
+        background_threshold = int(self.background_threshold_slider.get())
+        erode_size = int(self.erode_size_slider.get())
+
+        def run(job):
+            return preview_matting(oriented_image, masks, foreground_threshold, background_threshold, erode_size)
+
+        def on_done(preview_image):
+            # A full-resolution removal on its way supersedes the preview
+            if self.jobs.is_busy("remove"):
+                return
+            self.slider_frame.show_images(self.input_preview, preview_image, background=self.background_color)
+            self.status_label.configure(text="Previewing alpha matting. Click \"Remove Background\" to apply it "
+                                             "at full resolution.", text_color="gray")
+
+        def on_error(e):
+            self.status_label.configure(text=f"Preview failed: {e}", text_color="red")
+
+        # Slider moves arrive in bursts; the executor keeps only the newest preview
+        self.jobs.submit("matting-preview", run, on_done=on_done, on_error=on_error)
 
     def _update_display(self):
         """Helper method to update the displayed image and save button state."""
         if not self.current_processed_image_transparent:
-            self.final_image_to_save = None
-            self.slider_frame.show_images(self.input_image_pil)
-            self.save_button.configure(state="disabled")
+            self.slider_frame.show_images(self.input_preview)
+            # Until something has been processed the input itself can be saved
+            state = "normal" if self.input_image else "disabled"
+            self.save_button.configure(state=state)
+            self.export_all_button.configure(state=state)
             return
 
-        # Apply the background color to the current transparent image
-        if self.background_color:
-            colored_bg = Image.new("RGBA", self.current_processed_image_transparent.size, self.background_color)
-            self.final_image_to_save = Image.alpha_composite(colored_bg, self.current_processed_image_transparent)
-        else:
-            self.final_image_to_save = self.current_processed_image_transparent.copy()
-
-        self.slider_frame.show_images(self.input_image_pil, self.final_image_to_save)
+        # The slider puts the background color under its display-size copy; the full-resolution
+        # composite is only built when the image is saved
+        with profiling.stage("display"):
+            self.slider_frame.show_images(self.input_preview, self.current_processed_image_transparent,
+                                          background=self.background_color)
         self.save_button.configure(state="normal")
+        self.export_all_button.configure(state="normal")
+
+    def final_image(self, image, background_color):
+        """Returns an image over a background color, reusing the last composite while neither changed.
+
+        Images are never modified in place, so without a color the image itself is returned
+        instead of a copy. Safe to call from the export worker.
+        """
+        if not background_color:
+            return image
+        cached = self._composited
+        if cached and cached[0] is image and cached[1] == background_color:
+            return cached[2]
+        with profiling.stage("background compositing", size=list(image.size)):
+            colored_bg = Image.new("RGBA", image.size, background_color)
+            result = Image.alpha_composite(colored_bg, image)
+        self._composited = (image, background_color, result)
+        return result
 
     def browse_image(self):
         """Allows the user to select an image file and displays it."""
@@ -342,177 +621,424 @@ class AdvancedBackgroundRemoverApp(customtkinter.CTk):
         )
         if file_path:
             try:
-                # Store the file path and image data
+                # Results for the previous image are no longer wanted
+                self.jobs.cancel()
+                self.mask_cache.clear()
+
+                # Store the file path and image data. Only a reduced preview is decoded
+                # now; the full image waits until processing needs it.
                 self.input_file_path = file_path
-                self.input_image_pil = Image.open(file_path).convert("RGBA")
-                self.current_processed_image_transparent = self.input_image_pil.copy()
-                self.final_image_to_save = None
+                self.input_image = LazyImage(file_path)
+                self.input_preview = self.input_image.preview()
+                self.current_processed_image_transparent = None
+                self.upscale_source_image = None
+                self._composited = None
 
                 self._update_display()
 
-                self.status_label.configure(text=f"Image loaded: {os.path.basename(file_path)}", text_color="green")
+                self.status_label.configure(
+                    text=f"Image loaded: {os.path.basename(file_path)} ({self.input_image.width}x"
+                         f"{self.input_image.height}){self._memory_text()}",
+                    text_color="green")
                 self.remove_bg_button.configure(state="normal")
                 self.upscale_option_menu.set("No Upscaling")
                 self.upscale_option_menu.configure(state="normal")
 
+                # Warm up the default upscaler while the user looks at the image
+                self.preload_upscaler(UPSCALE_OPTIONS["2x Super-Resolution Upscaling"])
+
 
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to open image: {e}")
                 self.status_label.configure(text="Please select an image.", text_color="gray")
                 self.remove_bg_button.configure(state="disabled")
                 self.save_button.configure(state="disabled")
+                self.export_all_button.configure(state="disabled")
                 self.upscale_option_menu.configure(state="disabled")
 
+    def _show_progress(self, text):
+        """Shows the progress bar and cancel button for a background job."""
+        self.status_label.configure(text=text, text_color="orange")
+        self.progress_bar.set(0)
+        self.progress_frame.pack(pady=(0, 10), before=self.slider_frame)
+
+    def _hide_progress(self):
+        """Hides the progress bar once no background job is left."""
+        if not self.jobs.is_busy():
+            self.progress_frame.pack_forget()
+
+    def _memory_text(self):
+        rss = memory_usage()
+        return f", {format_bytes(rss)} in use" if rss is not None else ""
+
+    def _profile_mark(self):
+        """Remembers where the next job's profiling events start, while profiling is enabled."""
+        profiler = profiling.get_profiler()
+        return profiler.mark() if profiler else None
+
+    def _stage_text(self, mark):
+        """Describes where the time went since a mark, for the status bar."""
+        profiler = profiling.get_profiler()
+        if profiler is None or mark is None:
+            return ""
+        return " | " + profiling.format_summary(profiler.summary(since=mark))
+
+    def _on_job_progress(self, action, stage, fraction):
+        """Reflects the stage reported by a background job, and the memory in use, in the status bar."""
+        self.progress_bar.set(fraction)
+        self.status_label.configure(text=f"{action}: {stage}...{self._memory_text()}", text_color="orange")
+
+    def cancel_processing(self):
+        """Cancels every queued and running background job."""
+        self.jobs.cancel()
+
     def remove_background(self):
         """Removes the background from the selected image."""
-        if not self.input_image_pil:
+        if not self.input_image:
             messagebox.showwarning("Warning", "Please select an image first.")
             return
 
-        self.status_label.configure(text="Removing background...", text_color="orange")
-        self.progress_bar.pack()
-        self.progress_bar.start()
-        self.update()
+        # Get settings from UI
+        alpha_matting = self.alpha_matting_var.get() == "on"
+        alpha_matting_foreground_threshold = int(self.foreground_threshold_slider.get()) if alpha_matting else 240
+        alpha_matting_background_threshold = int(self.background_threshold_slider.get()) if alpha_matting else 10
+        alpha_matting_erode_size = int(self.erode_size_slider.get()) if alpha_matting else 10
+        model_name = self.rembg_model_menu.get()
+        input_image = self.input_image
+        profile_mark = self._profile_mark()
 
-        try:
-            # Get settings from UI
-            alpha_matting = self.alpha_matting_var.get() == "on"
-            alpha_matting_foreground_threshold = int(self.foreground_threshold_slider.get()) if alpha_matting else 240
-            alpha_matting_background_threshold = int(self.background_threshold_slider.get()) if alpha_matting else 10
-            alpha_matting_erode_size = int(self.erode_size_slider.get()) if alpha_matting else 10
+        def run(job):
+            # Reuse the warm session for the selected model
+            job.report("loading model")
+            session = self.session_manager.get(model_name)
+
+            # The full-resolution decode happens here, off the main thread, the first time it is needed
+            job.report("decode")
+            image = input_image.load()
 
             # The core background removal logic
-            output_image = remove(
-                self.input_image_pil,
+            return remove_background(
+                image,
+                session,
                 alpha_matting=alpha_matting,
-                alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
-                alpha_matting_background_threshold=alpha_matting_background_threshold,
-                alpha_matting_erode_size=alpha_matting_erode_size
+                foreground_threshold=alpha_matting_foreground_threshold,
+                background_threshold=alpha_matting_background_threshold,
+                erode_size=alpha_matting_erode_size,
+                mask_cache=self.mask_cache,
+                disk_cache=self.disk_cache,
+                progress=job.report
             )
-            self.current_processed_image_transparent = output_image
 
+        def on_done(output_image):
+            self.current_processed_image_transparent = output_image
+            self.upscale_source_image = output_image
+            self.upscale_option_menu.set("No Upscaling")
             self._update_display()
+            self.status_label.configure(
+                text=f"Background removed successfully!{self._memory_text()}{self._stage_text(profile_mark)}",
+                text_color="green")
+            self._finish_removal()
 
-            self.status_label.configure(text="Background removed successfully!", text_color="green")
-        except Exception as e:
+        def on_error(e):
             messagebox.showerror("Processing Error", f"An error occurred during background removal: {e}")
             self.status_label.configure(text="Removal failed.", text_color="red")
-        finally:
-            self.progress_bar.stop()
-            self.progress_bar.pack_forget()
+            self._finish_removal()
+
+        def on_cancel():
+            # A newer removal replacing this one is not worth reporting
+            if not self.jobs.is_busy("remove"):
+                self.status_label.configure(text="Removal cancelled.", text_color="gray")
+            self._finish_removal()
+
+        # Upscaling works from the removal result, so wait for it
+        self.upscale_option_menu.configure(state="disabled")
+        self.jobs.cancel("matting-preview")
+        self._show_progress("Removing background...")
+        self.jobs.submit(
+            "remove", run, REMOVE_STAGES,
+            on_done=on_done,
+            on_error=on_error,
+            on_progress=lambda stage, fraction: self._on_job_progress("Removing background", stage, fraction),
+            on_cancel=on_cancel
+        )
+
+    def batch_remove_backgrounds(self):
+        """Removes the background from several images and saves the results to a folder."""
+        file_paths = filedialog.askopenfilenames(
+            title="Select Images",
+            filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.webp")]
+        )
+        if not file_paths:
+            return
+        output_dir = filedialog.askdirectory(title="Select Output Folder")
+        if not output_dir:
+            return
+
+        alpha_matting = self.alpha_matting_var.get() == "on"
+        alpha_matting_foreground_threshold = int(self.foreground_threshold_slider.get()) if alpha_matting else 240
+        alpha_matting_background_threshold = int(self.background_threshold_slider.get()) if alpha_matting else 10
+        alpha_matting_erode_size = int(self.erode_size_slider.get()) if alpha_matting else 10
+        model_name = self.rembg_model_menu.get()
+        background_color = self.background_color
+        options = encoder_options("png", self.export_preset_menu.get())
+        # Files with the same name from different folders would overwrite each other's result
+        outputs, conflicts = output_paths(file_paths, output_dir, "png")
+        file_paths = [file_path for file_path in file_paths if file_path in outputs]
+
+        def run(job):
+            job.report("loading model")
+            session = self.session_manager.get(model_name)
+
+            # Load and segment one group at a time, so memory stays bounded however many files were picked
+            batch_size = segmentation_batch_size(model_name)
+            failed = []
+            for start in range(0, len(file_paths), batch_size):
+                job.report("removing backgrounds", start / len(file_paths))
+                group = []
+                for file_path in file_paths[start:start + batch_size]:
+                    try:
+                        group.append((file_path, Image.open(file_path).convert("RGBA")))
+                    except Exception:
+                        failed.append(os.path.basename(file_path))
+
+                output_images = remove_backgrounds(
+                    [image for _, image in group],
+                    session,
+                    alpha_matting=alpha_matting,
+                    foreground_threshold=alpha_matting_foreground_threshold,
+                    background_threshold=alpha_matting_background_threshold,
+                    erode_size=alpha_matting_erode_size,
+                    batch_size=batch_size,
+                    disk_cache=self.disk_cache,
+                    progress=lambda stage, fraction: job.check_cancelled()
+                )
+                for (file_path, _), output_image in zip(group, output_images):
+                    if background_color:
+                        colored_bg = Image.new("RGBA", output_image.size, background_color)
+                        output_image = Image.alpha_composite(colored_bg, output_image)
+                    write_image(output_image, outputs[file_path], "png", options)
+            return len(file_paths) - len(failed), failed
+
+        def on_done(result):
+            saved, failed = result
+            if failed:
+                messagebox.showwarning("Batch Removal", f"Could not open: {', '.join(failed)}")
+            if conflicts:
+                skipped = [os.path.basename(path) for _, input_paths in conflicts for path in input_paths]
+                messagebox.showwarning("Batch Removal", f"Skipped files with the same name: {', '.join(skipped)}")
+            self.status_label.configure(text=f"Saved {saved} image(s) to {output_dir}", text_color="green")
+            self._hide_progress()
+
+        def on_error(e):
+            messagebox.showerror("Processing Error", f"An error occurred during batch removal: {e}")
+            self.status_label.configure(text="Batch removal failed.", text_color="red")
+            self._hide_progress()
+
+        def on_cancel():
+            self.status_label.configure(text="Batch removal cancelled.", text_color="gray")
+            self._hide_progress()
+
+        self._show_progress(f"Removing backgrounds from {len(file_paths)} image(s)...")
+        self.jobs.submit(
+            "batch-remove", run, ("loading model", "removing backgrounds"),
+            on_done=on_done,
+            on_error=on_error,
+            on_progress=lambda stage, fraction: self._on_job_progress("Batch removal", stage, fraction),
+            on_cancel=on_cancel
+        )
+
+    def _finish_removal(self):
+        if not self.jobs.is_busy("remove"):
+            self.upscale_option_menu.configure(state="normal")
+        self._hide_progress()
+
+    def preload_upscaler(self, scale):
+        """Loads the upscaling model in the background and reports when it is ready."""
+        self.model_registry.preload(scale)
+        self._poll_upscaler_ready(scale)
+
+    def _poll_upscaler_ready(self, scale):
+        """Updates the upscaler status label until the model has finished loading."""
+        if self.model_registry.is_ready(scale):
+            self.upscaler_status_label.configure(text=f"{scale}x upscaler ready", text_color="green")
+        elif self.model_registry.is_loading(scale):
+            self.upscaler_status_label.configure(text=f"Loading {scale}x upscaler...", text_color="orange")
+            self.after(200, self._poll_upscaler_ready, scale)
+        elif self.model_registry.load_error(scale):
+            self.upscaler_status_label.configure(text=f"{scale}x upscaler unavailable", text_color="red")
 
     def upscale_image(self, choice):
         """Upscales the processed image based on the selected option."""
-        if not self.current_processed_image_transparent:
+        if not self.input_image:
             messagebox.showwarning("Warning", "Please load an image first.")
             self.upscale_option_menu.set("No Upscaling")
             return
 
+        # Always upscale from the un-upscaled result, so a newer choice simply replaces an older one
         if choice == "No Upscaling":
+            self.jobs.cancel("upscale")
+            self.current_processed_image_transparent = self.upscale_source_image
             self._update_display()
             return
 
-        self.status_label.configure(text=f"Upscaling image with '{choice}'...", text_color="orange")
-        self.progress_bar.pack()
-        self.progress_bar.start()
-        self.update()
-
-        try:
-            image_to_upscale = self.current_processed_image_transparent
-
-            # Load the 2x model
-            model = EdsrModel.from_pretrained('eugenesiow/edsr-base', scale=2)
-
-            # Convert PIL image to tensor
-            # Note: The model is trained on RGB, so we convert before processing.
-            inputs = ImageLoader.load_image(image_to_upscale.convert("RGB"))
-
-            # Perform upscaling
-            with torch.no_grad():
-                outputs = model(inputs)
-
-            # Corrected logic: Convert output tensor back to PIL Image
-            # The tensor is in C, H, W format. We need to permute it to H, W, C for PIL.
-            upscaled_rgb_tensor = outputs.squeeze(0).permute(1, 2, 0)
-            upscaled_rgb_image = Image.fromarray(
-                torch.clamp(upscaled_rgb_tensor.mul(255).round(), 0, 255).byte().cpu().numpy()
-            )
-
-            # Restore alpha channel from original image, if it existed
-            if 'A' in image_to_upscale.getbands():
-                alpha_channel = image_to_upscale.getchannel('A')
-                upscaled_alpha = alpha_channel.resize(upscaled_rgb_image.size, Image.LANCZOS)
-                upscaled_rgb_image.putalpha(upscaled_alpha)
-
-            self.current_processed_image_transparent = upscaled_rgb_image
-
+        scale = UPSCALE_OPTIONS[choice]
+        image_to_upscale = self.upscale_source_image
+        input_image = self.input_image
+        profile_mark = self._profile_mark()
+
+        def run(job):
+            # Reuse the warm model for this scale, loading it only the first time
+            job.report("loading model")
+            model = self.model_registry.get(scale)
+            image = image_to_upscale
+            if image is None:
+                # Nothing was removed yet, so upscale the original
+                job.report("decode")
+                image = input_image.load()
+            # Transparent areas stay invisible, so only the subject goes through the model,
+            # several tiles at a time
+            return upscale(image, model, progress=job.report, disk_cache=self.disk_cache,
+                           skip_transparent=True, workers=auto_workers())
+
+        def on_done(upscaled_image):
+            self._poll_upscaler_ready(scale)
+            self.current_processed_image_transparent = upscaled_image
             self._update_display()
-
-            self.status_label.configure(text="Image upscaled successfully with Super-Resolution!", text_color="green")
-        except OSError as e:
-            # Handle the specific error where the model fails to load.
-            messagebox.showerror("Processing Error",
-                                 f"An error occurred during upscaling: Failed to load model. Please check your internet connection or try again later.")
-            self.status_label.configure(text="Upscaling failed.", text_color="red")
-        except Exception as e:
-            messagebox.showerror("Processing Error", f"An error occurred during upscaling: {e}")
+            self.status_label.configure(
+                text=f"Image upscaled successfully with Super-Resolution!{self._stage_text(profile_mark)}",
+                text_color="green")
+            self._hide_progress()
+
+        def on_error(e):
+            self._poll_upscaler_ready(scale)
+            if isinstance(e, OSError):
+                # Handle the specific error where the model fails to load.
+                messagebox.showerror("Processing Error",
+                                     "An error occurred during upscaling: Failed to load model. Please check your "
+                                     "internet connection or place the weights in the folder set by BGXUP_WEIGHTS_DIR.")
+            else:
+                messagebox.showerror("Processing Error", f"An error occurred during upscaling: {e}")
             self.status_label.configure(text="Upscaling failed.", text_color="red")
-        finally:
-            self.progress_bar.stop()
-            self.progress_bar.pack_forget()
+            self._hide_progress()
+
+        def on_cancel():
+            if not self.jobs.is_busy("upscale"):
+                self.status_label.configure(text="Upscaling cancelled.", text_color="gray")
+            self._hide_progress()
+
+        self._show_progress(f"Upscaling image with '{choice}'...")
+        self.jobs.submit(
+            "upscale", run, UPSCALE_STAGES,
+            on_done=on_done,
+            on_error=on_error,
+            on_progress=lambda stage, fraction: self._on_job_progress("Upscaling", stage, fraction),
+            on_cancel=on_cancel
+        )
 
     def select_background_color(self):
         """Allows the user to choose a background color."""
         color_code = colorchooser.askcolor(title="Choose background color")
-        if color_code:
+        # Cancelling the dialog returns no color and keeps the current one
+        if color_code[1] and color_code[1] != self.background_color:
             self.background_color = color_code[1]
             self.color_preview.itemconfig(self.color_preview_rect, fill=self.background_color)
 
             self._update_display()
 
-    def apply_background_color(self, image_pil):
-        """Applies the selected background color to a PIL image."""
-        if self.background_color and image_pil:
-            colored_bg = Image.new("RGBA", image_pil.size, self.background_color)
-            colored_bg.paste(image_pil, (0, 0), image_pil)
-            return colored_bg
-        return image_pil
+    def _output_base_name(self):
+        if self.input_file_path:
+            return os.path.splitext(os.path.basename(self.input_file_path))[0] + "-processed"
+        return "processed_image"
 
     def save_image(self):
-        """Saves the current processed image to a file."""
-        if not self.final_image_to_save:
-            messagebox.showwarning("Warning", "No image to save. Please process an image first.")
+        """Saves the current processed image to a file, encoding it in the background."""
+        image = self.current_processed_image_transparent or self.input_image
+        if not image:
+            messagebox.showwarning("Warning", "No image to save. Please select an image first.")
             return
 
-        if self.input_file_path:
-            base_name = os.path.basename(self.input_file_path)
-            file_name_without_ext = os.path.splitext(base_name)[0]
-            initial_file_name = file_name_without_ext + "-processed.png"
-        else:
-            initial_file_name = "processed_image.png"
-
         save_path = filedialog.asksaveasfilename(
             title="Save Processed Image",
             defaultextension=".png",
-            filetypes=[("PNG files", "*.png"), ("JPG files", "*.jpg"), ("All files", "*.*")],
-            initialfile=initial_file_name
+            filetypes=[("PNG files", "*.png"), ("JPG files", "*.jpg"), ("WebP files", "*.webp"),
+                       ("All files", "*.*")],
+            initialfile=self._output_base_name() + ".png"
         )
-        if save_path:
-            try:
-                # Convert to RGB if saving as JPG/JPEG and a background color is set
-                image_to_save = self.final_image_to_save
-                if self.background_color and (
-                        save_path.lower().endswith('.jpg') or save_path.lower().endswith('.jpeg')):
-                    image_to_save = image_to_save.convert("RGB")
-
-                image_to_save.save(save_path)
-                self.status_label.configure(text=f"Image saved successfully!", text_color="green")
-                messagebox.showinfo("Success", "Image saved successfully!")
-            except Exception as e:
-                messagebox.showerror("Save Error", f"Failed to save image: {e}")
-                self.status_label.configure(text="Saving failed.", text_color="red")
+        if not save_path:
+            return
+        try:
+            output_format = format_for_path(save_path)
+        except ValueError as e:
+            messagebox.showerror("Save Error", f"Failed to save image: {e}")
+            return
+
+        # Read the settings now; the user may change them while the file is written
+        options = encoder_options(output_format, self.export_preset_menu.get())
+        background_color = self.background_color
+        save_mark = self._profile_mark()
+
+        def run(job):
+            source = image.load() if isinstance(image, LazyImage) else image
+            return write_image(self.final_image(source, background_color), save_path, output_format, options)
+
+        def on_done(size):
+            self.status_label.configure(
+                text=f"Image saved successfully! ({format_bytes(size)}){self._stage_text(save_mark)}",
+                text_color="green")
+            messagebox.showinfo("Success", "Image saved successfully!")
+
+        def on_error(e):
+            messagebox.showerror("Save Error", f"Failed to save image: {e}")
+            self.status_label.configure(text="Saving failed.", text_color="red")
+
+        self.status_label.configure(text=f"Saving {os.path.basename(save_path)}...", text_color="orange")
+        # Keyed by path, so saving two files at once keeps both
+        self.exports.submit(("save", save_path), run, on_done=on_done, on_error=on_error)
+
+    def export_all_formats(self):
+        """Saves the processed image as PNG, JPG and WebP to a folder, encoding the files in parallel."""
+        image = self.current_processed_image_transparent or self.input_image
+        if not image:
+            messagebox.showwarning("Warning", "No image to save. Please select an image first.")
+            return
+
+        output_dir = filedialog.askdirectory(title="Select Folder for the Exported Images")
+        if not output_dir:
+            return
+
+        preset = self.export_preset_menu.get()
+        base_path = os.path.join(output_dir, self._output_base_name())
+        targets = [(f"{base_path}.{output_format}", output_format, encoder_options(output_format, preset))
+                   for output_format in ("png", "jpg", "webp")]
+        background_color = self.background_color
+        save_mark = self._profile_mark()
+
+        def run(job):
+            source = image.load() if isinstance(image, LazyImage) else image
+            return export_many(self.final_image(source, background_color), targets)
+
+        def on_done(results):
+            saved = [f"{os.path.splitext(path)[1][1:]} {format_bytes(size)}" for path, size, _, error in results
+                     if error is None]
+            failed = [f"{os.path.basename(path)}: {error}" for path, _, _, error in results if error is not None]
+            if failed:
+                messagebox.showerror("Export Error", "Failed to export:\n" + "\n".join(failed))
+            self.status_label.configure(
+                text=f"Exported {', '.join(saved) or 'nothing'} to {output_dir}{self._stage_text(save_mark)}",
+                text_color="red" if failed else "green")
+
+        def on_error(e):
+            messagebox.showerror("Export Error", f"Failed to export images: {e}")
+            self.status_label.configure(text="Export failed.", text_color="red")
+
+        self.status_label.configure(text=f"Exporting to {output_dir}...", text_color="orange")
+        self.exports.submit(("export", output_dir), run, on_done=on_done, on_error=on_error)
 
 
 if __name__ == "__main__":
+    # BGXUP_TRACE=1 shows per-stage timings in the status bar; a file name also writes a trace there on exit
+    trace_path = profiling.enable_from_environment()
     app = AdvancedBackgroundRemoverApp()
     app.mainloop()
+    if trace_path:
+        profiling.get_profiler().save(trace_path)
@@ -0,0 +1,431 @@
+"""Local HTTP service that keeps the models warm for other tools.
+
+Example:
+    python server.py --port 8765 --max-batch 8 --batch-window-ms 20
+
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/remove?alpha_matting=1" -o photo.png
+    curl --data-binary @photo.png "http://127.0.0.1:8765/upscale?scale=2" -o photo-2x.png
+    curl http://127.0.0.1:8765/metrics
+
+Requests that arrive within the batch window are processed together. When a queue
+is full the server answers 503 with a Retry-After header instead of queueing more.
+"""
+import argparse
+import io
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image, ImageColor
+
+from disk_cache import DiskCache
+from profiles import DEFAULT_PROFILE, PROFILES
+from sessions import DEFAULT_MODEL, model_names
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 8
+DEFAULT_BATCH_WINDOW_MS = 20
+DEFAULT_MAX_QUEUE = 64
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# Latencies kept per endpoint for the percentiles in /metrics
+LATENCY_WINDOW = 1024
+
+
+class QueueFull(Exception):
+    """Raised when a batcher already holds as many requests as it may."""
+
+
+class PendingRequest:
+    def __init__(self, payload):
+        self.payload = payload
+        self.result = None
+        self.error = None
+        self.submitted = time.perf_counter()
+        self._done = threading.Event()
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class LatencyTracker:
+    """Keeps the most recent latencies and reports their percentiles."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentiles(self, points=(50, 95, 99)):
+        """Return {"p50": ms, ...} using the nearest-rank method, or None values when empty."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return {f"p{point}": None for point in points}
+        ranks = {point: max(0, math.ceil(point / 100 * len(latencies)) - 1) for point in points}
+        return {f"p{point}": round(latencies[rank] * 1000, 2) for point, rank in ranks.items()}
+
+
+class MicroBatcher:
+    """Collects concurrent requests into batches for a single worker thread.
+
+    The worker takes the oldest request, waits up to `window` seconds for more to
+    arrive, and hands at most `max_batch` payloads to process_batch, which returns
+    one result (or exception) per payload.
+    """
+
+    def __init__(self, name, process_batch, max_batch=DEFAULT_MAX_BATCH, window=DEFAULT_BATCH_WINDOW_MS / 1000,
+                 max_queue=DEFAULT_MAX_QUEUE):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.window = window
+        self.max_queue = max_queue
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self.latency = LatencyTracker()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batches = 0
+
+        self._worker = threading.Thread(target=self._work, name=f"batcher-{name}", daemon=True)
+        self._worker.start()
+
+    def submit(self, payload):
+        """Queue a payload and return its PendingRequest, or raise QueueFull."""
+        request = PendingRequest(payload)
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"{self.name} queue is full ({self.max_queue} requests)")
+            self._queue.append(request)
+            self._condition.notify()
+        return request
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            # Give concurrent clients a short window to join the batch
+            deadline = self._queue[0].submitted + self.window
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.process_batch([request.payload for request in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+
+            finished = time.perf_counter()
+            with self._condition:
+                self.batches += 1
+                for request, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        self.failed += 1
+                    else:
+                        self.completed += 1
+            for request, result in zip(batch, results):
+                self.latency.add(finished - request.submitted)
+                if isinstance(result, Exception):
+                    request.finish(error=result)
+                else:
+                    request.finish(result=result)
+
+    def metrics(self):
+        with self._condition:
+            metrics = {
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "mean_batch_size": round((self.completed + self.failed) / self.batches, 2) if self.batches else None,
+            }
+        metrics["latency_ms"] = self.latency.percentiles()
+        return metrics
+
+
+class InferenceService:
+    """Warm models plus one batcher per endpoint."""
+
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, window=DEFAULT_BATCH_WINDOW_MS / 1000,
+                 max_queue=DEFAULT_MAX_QUEUE, weights_dir=None, disk_cache=None, profile=DEFAULT_PROFILE):
+        from profiles import new_session
+        from sessions import RembgSessionManager
+        from upscaler import EdsrModelRegistry
+
+        self.profile = profile
+        self.session_manager = RembgSessionManager(
+            session_factory=lambda model_name: new_session(model_name, profile))
+        self.model_registry = EdsrModelRegistry(weights_dir=weights_dir, profile=profile)
+        self.disk_cache = disk_cache
+        self.started = time.time()
+        self.batchers = {
+            "remove": MicroBatcher("remove", self._remove_batch, max_batch, window, max_queue),
+            "upscale": MicroBatcher("upscale", self._upscale_batch, max_batch, window, max_queue),
+        }
+
+    def warm_up(self, model_name=DEFAULT_MODEL, scales=()):
+        self.session_manager.get(model_name)
+        for scale in scales:
+            self.model_registry.get(scale)
+
+    def _remove_batch(self, payloads):
+        """Segment requests that share a model and settings in one network call per group."""
+        from pipeline import remove_backgrounds
+
+        results = [None] * len(payloads)
+        groups = {}
+        for index, (image, options) in enumerate(payloads):
+            groups.setdefault(tuple(sorted(options.items())), []).append(index)
+
+        for key, indices in groups.items():
+            options = dict(key)
+            try:
+                session = self.session_manager.get(options["model"])
+                images = remove_backgrounds(
+                    [payloads[index][0] for index in indices],
+                    session,
+                    alpha_matting=options["alpha_matting"],
+                    foreground_threshold=options["foreground_threshold"],
+                    background_threshold=options["background_threshold"],
+                    erode_size=options["erode_size"],
+                    batch_size=len(indices),
+                    disk_cache=self.disk_cache
+                )
+            except Exception as e:
+                images = [e] * len(indices)
+            for index, image in zip(indices, images):
+                results[index] = image
+        return results
+
+    def _upscale_batch(self, payloads):
+        """Upscale each request in turn, spreading its tiles over the cores.
+
+        Images of different sizes cannot share an EDSR pass.
+        """
+        from upscaler import auto_workers, upscale
+
+        results = []
+        for image, options in payloads:
+            try:
+                results.append(upscale(image, self.model_registry.get(options["scale"]),
+                                       disk_cache=self.disk_cache,
+                                       skip_transparent=options["skip_transparent"],
+                                       workers=auto_workers()))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def metrics(self):
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "profile": self.profile,
+            "endpoints": {name: batcher.metrics() for name, batcher in self.batchers.items()},
+            "sessions": self.session_manager.stats(),
+            "cache": self.disk_cache.stats() if self.disk_cache else None,
+        }
+
+
+def _flag(query, name, default=False):
+    value = query.get(name, [None])[0]
+    return default if value is None else value.lower() in ("1", "true", "yes", "on")
+
+
+def _int(query, name, default):
+    value = query.get(name, [None])[0]
+    return default if value is None else int(value)
+
+
+def parse_remove_options(query):
+    model = query.get("model", [DEFAULT_MODEL])[0]
+    if model not in model_names():
+        raise ValueError(f"unknown model {model!r}")
+    alpha_matting = _flag(query, "alpha_matting")
+    return {
+        "model": model,
+        "alpha_matting": alpha_matting,
+        "foreground_threshold": _int(query, "foreground_threshold", 240) if alpha_matting else 240,
+        "background_threshold": _int(query, "background_threshold", 10) if alpha_matting else 10,
+        "erode_size": _int(query, "erode_size", 10) if alpha_matting else 10,
+    }
+
+
+def parse_upscale_options(query):
+    scale = _int(query, "scale", 2)
+    if scale not in (2, 3, 4):
+        raise ValueError("scale must be 2, 3 or 4")
+    return {"scale": scale, "skip_transparent": _flag(query, "skip_transparent", True)}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None
+    server_version = "bgxup"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep the console quiet under load; /metrics reports what matters
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data, headers=None):
+        self._send(status, json.dumps(data, indent=2).encode(), headers=headers)
+
+    def _discard_body(self, length):
+        """Skip an unwanted request body, so the next request on the connection starts at its request line."""
+        if 0 < length <= MAX_BODY_BYTES:
+            while length > 0:
+                chunk = self.rfile.read(min(length, 64 * 1024))
+                if not chunk:
+                    break
+                length -= len(chunk)
+        elif length:
+            # Too large to read, or of unknown size: the connection cannot be reused
+            self.close_connection = True
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.service.metrics())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip("/")
+        batcher = self.service.batchers.get(endpoint)
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if batcher is None:
+            self._discard_body(length)
+            self._send_json(404, {"error": f"unknown endpoint {url.path}"})
+            return
+        if not 0 < length <= MAX_BODY_BYTES:
+            self._discard_body(length)
+            self._send_json(413 if length > 0 else 400, {"error": "send the image file as the request body"})
+            return
+
+        body = self.rfile.read(length)
+        query = parse_qs(url.query)
+        try:
+            image = Image.open(io.BytesIO(body)).convert("RGBA")
+            if endpoint == "remove":
+                options = parse_remove_options(query)
+                background_color = query.get("background_color", [None])[0]
+                background_color = ImageColor.getrgb(background_color) if background_color else None
+            else:
+                options = parse_upscale_options(query)
+                background_color = None
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            request = batcher.submit((image, options))
+        except QueueFull as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+
+        try:
+            result = request.wait()
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        if background_color:
+            colored_bg = Image.new("RGBA", result.size, background_color)
+            result = Image.alpha_composite(colored_bg, result)
+        output = io.BytesIO()
+        # Favour latency over file size; the client can recompress
+        result.save(output, "PNG", compress_level=1)
+        self._send(200, output.getvalue(), "image/png")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve background removal and upscaling over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind, localhost by default")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="most requests per batch")
+    parser.add_argument("--batch-window-ms", type=float, default=DEFAULT_BATCH_WINDOW_MS,
+                        help="how long the first request of a batch waits for others to join")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="queued requests per endpoint before answering 503")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="segmentation model to load at startup")
+    parser.add_argument("--preload-scale", type=int, action="append", choices=(2, 3, 4), default=[],
+                        help="upscaling model to load at startup, may be repeated")
+    parser.add_argument("--weights-dir", help="local EDSR weights, for machines without network access")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="inference profile: float32 quality, thread-tuned balanced or int8 fast")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the result cache")
+    parser.add_argument("--cache-dir", help="result cache directory (default: $BGXUP_CACHE_DIR or ~/.cache/bgxup)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    service = InferenceService(
+        max_batch=max(1, args.max_batch),
+        window=args.batch_window_ms / 1000,
+        max_queue=max(1, args.max_queue),
+        weights_dir=args.weights_dir,
+        disk_cache=None if args.no_cache else DiskCache(args.cache_dir),
+        profile=args.profile,
+    )
+    print("Loading models...")
+    service.warm_up(args.model, args.preload_scale)
+
+    handler = type("BoundRequestHandler", (RequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"Listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+
+import profiling
+
+DEFAULT_MODEL = "u2net"
+
+# Rough multiplier from the .onnx file size to the resident size of a loaded
+# session (weights plus the optimized graph and its arena).
+SESSION_MEMORY_FACTOR = 2
+
+
+def model_names():
+    """Return the names of the segmentation models rembg knows how to load."""
+    from rembg.sessions import sessions_names
+
+    return list(sessions_names)
+
+
+def new_session(model_name):
+    """Create a rembg session, importing rembg (and onnxruntime) only when first needed."""
+    from rembg import new_session
+
+    return new_session(model_name)
+
+
+class RembgSessionManager:
+    """Creates each rembg model session once and reuses it, evicting by LRU under a memory cap."""
+
+    def __init__(self, max_memory_mb=1024, session_factory=None):
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024) if max_memory_mb else None
+        self.session_factory = session_factory or new_session
+
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._creation_locks = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_name=DEFAULT_MODEL):
+        """Return the warm session for the given model, creating it on first use."""
+        with self._lock:
+            session = self._sessions.get(model_name)
+            if session is not None:
+                self._sessions.move_to_end(model_name)
+                self.hits += 1
+                return session
+            creation_lock = self._creation_locks.setdefault(model_name, threading.Lock())
+
+        # Build outside the main lock so other models stay available, but make
+        # sure two threads asking for the same model only build it once.
+        with creation_lock:
+            with self._lock:
+                session = self._sessions.get(model_name)
+                if session is not None:
+                    self._sessions.move_to_end(model_name)
+                    self.hits += 1
+                    return session
+                self.misses += 1
+
+            with profiling.stage("load model", model=model_name):
+                session = self.session_factory(model_name)
+            size = self._estimate_size(session)
+
+            with self._lock:
+                self._sessions[model_name] = session
+                self._sizes[model_name] = size
+                self._evict(keep=model_name)
+            return session
+
+    def _estimate_size(self, session):
+        """Estimate the resident size of a session from its model file."""
+        inner = getattr(session, "inner_session", None)
+        model_path = getattr(inner, "_model_path", None)
+        if model_path and os.path.isfile(model_path):
+            return os.path.getsize(model_path) * SESSION_MEMORY_FACTOR
+        return 0
+
+    def _evict(self, keep):
+        """Drop least recently used sessions until the memory cap is respected."""
+        if self.max_memory_bytes is None:
+            return
+        while self.memory_usage() > self.max_memory_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            del self._sessions[oldest]
+            del self._sizes[oldest]
+            self.evictions += 1
+
+    def memory_usage(self):
+        """Return the estimated memory held by cached sessions, in bytes."""
+        return sum(self._sizes.values())
+
+    def loaded_models(self):
+        """Return the cached model names, least recently used first."""
+        with self._lock:
+            return list(self._sessions)
+
+    def clear(self):
+        """Drop every cached session."""
+        with self._lock:
+            self._sessions.clear()
+            self._sizes.clear()
+
+    def stats(self):
+        """Return cache counters so warm-path behaviour can be checked."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "loaded": list(self._sessions),
+                "memory_bytes": self.memory_usage(),
+            }
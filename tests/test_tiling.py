@@ -0,0 +1,41 @@
+"""Tiled upscaling must match a single pass of the model, seams included."""
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+super_image = pytest.importorskip("super_image")
+
+from upscaler import upscale_array  # noqa: E402
+
+# Odd sizes and tile sizes make sure partial tiles at the right and bottom edges are covered
+CASES = [(64, 64, 32), (97, 131, 32), (75, 40, 48), (120, 90, 17)]
+
+# Two residual blocks see about 8 input pixels in each direction, so these overlaps all cover it
+OVERLAPS = (12, 40)
+
+# Largest per-channel difference allowed, from float rounding in the cross-fade
+TOLERANCE = 1
+
+
+@pytest.fixture(scope="module", params=(2, 3), ids=lambda scale: f"{scale}x")
+def model(request):
+    """A tiny randomly initialised EDSR; seam correctness does not depend on the weights."""
+    torch.manual_seed(0)
+    config = super_image.EdsrConfig(scale=request.param, n_resblocks=2, n_feats=16)
+    return super_image.EdsrModel(config).eval()
+
+
+@pytest.mark.parametrize("workers", (1, 3))
+@pytest.mark.parametrize("overlap", OVERLAPS)
+@pytest.mark.parametrize("height, width, tile_size", CASES)
+def test_tiled_matches_single_pass(model, height, width, tile_size, overlap, workers):
+    rng = np.random.default_rng(height * width + tile_size)
+    image = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+
+    reference = upscale_array(image, model, tile_size=max(height, width))
+    tiled = upscale_array(image, model, tile_size=tile_size, overlap=overlap, workers=workers)
+
+    scale = model.config.scale
+    assert tiled.shape == (height * scale, width * scale, 3)
+    difference = np.abs(tiled.astype(np.int16) - reference.astype(np.int16))
+    assert difference.max() <= TOLERANCE
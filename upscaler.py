@@ -0,0 +1,462 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import profiling
+
+DEFAULT_MODEL_ID = "eugenesiow/edsr-base"
+
+# Directory holding local copies of the weights, laid out as
+# <dir>/<model name>/config.json and pytorch_model_<scale>x.pt
+WEIGHTS_DIR_ENV = "BGXUP_WEIGHTS_DIR"
+
+# Context added around every tile. EDSR-base sees roughly 36 input pixels in
+# each direction, so this margin keeps tile interiors identical to a single pass.
+DEFAULT_OVERLAP = 40
+
+# Half-width of the band over which neighbouring tiles are cross-faded
+DEFAULT_BLEND = 8
+
+# Never give the upscaler more than this, however much RAM is free
+DEFAULT_MEMORY_BUDGET_MB = 2048
+MIN_TILE_SIZE = 64
+
+# Tile size used when transparent tiles are skipped. Smaller tiles follow the
+# outline of the subject more closely, at the cost of more overlap per tile.
+FOREGROUND_TILE_SIZE = 256
+
+# LANCZOS reaches 3 input pixels out when the alpha channel is resized, so tiles
+# within this distance of a visible pixel still go through the model
+FOREGROUND_MARGIN = 4
+
+# Cores given to each tile worker by auto_workers. EDSR's convolutions keep about
+# this many threads busy; beyond that, running more tiles at once scales better.
+THREADS_PER_TILE_WORKER = 4
+
+# Stages reported by upscale, in order
+UPSCALE_STAGES = ("loading model", "decode", "inference", "compositing")
+
+
+class EdsrModelRegistry:
+    """Loads each (model, scale) pair once in eval mode and keeps it warm.
+
+    With an inference profile (see profiles.py), each model is prepared for that
+    profile's backend once it is loaded, e.g. exported to ONNX and quantized.
+    """
+
+    def __init__(self, model_id=DEFAULT_MODEL_ID, weights_dir=None, profile=None, threads=None):
+        self.model_id = model_id
+        self.weights_dir = weights_dir or os.environ.get(WEIGHTS_DIR_ENV)
+        self.profile = profile
+        self.threads = threads
+
+        self._models = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._errors = {}
+
+    def resolve_source(self, scale):
+        """Return a local weights directory for the model if one exists, else the hub id."""
+        if self.weights_dir:
+            weights_name = f"pytorch_model_{scale}x.pt"
+            candidates = [
+                os.path.join(self.weights_dir, self.model_id.split("/")[-1]),
+                self.weights_dir,
+            ]
+            for candidate in candidates:
+                if os.path.isfile(os.path.join(candidate, weights_name)):
+                    return candidate
+        return self.model_id
+
+    def _load(self, scale):
+        from super_image import EdsrModel
+
+        with profiling.stage("load model", model=self.model_id, scale=scale, profile=self.profile):
+            model = EdsrModel.from_pretrained(self.resolve_source(scale), scale=scale)
+            model.eval()
+            if self.profile is not None:
+                from profiles import prepare_upscaler
+
+                model = prepare_upscaler(model, self.profile, self.threads)
+        return model
+
+    def get(self, scale=2):
+        """Return the warm model for the given scale, loading it on first use."""
+        with self._lock:
+            model = self._models.get(scale)
+            if model is not None:
+                return model
+            event = self._loading.get(scale)
+            if event is None:
+                event = threading.Event()
+                self._loading[scale] = event
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            # Another thread (usually the preloader) is already loading it
+            event.wait()
+            with self._lock:
+                if scale in self._models:
+                    return self._models[scale]
+                error = self._errors.get(scale)
+            raise error or OSError(f"Failed to load upscaling model for scale {scale}")
+
+        try:
+            model = self._load(scale)
+        except Exception as e:
+            with self._lock:
+                self._errors[scale] = e
+                del self._loading[scale]
+            event.set()
+            raise
+
+        with self._lock:
+            self._models[scale] = model
+            self._errors.pop(scale, None)
+            del self._loading[scale]
+        event.set()
+        return model
+
+    def preload(self, scale=2):
+        """Start loading the model for the given scale on a background thread."""
+        if self.is_ready(scale) or self.is_loading(scale):
+            return
+
+        def worker():
+            try:
+                self.get(scale)
+            except Exception:
+                # The error is kept in self._errors and re-raised on the next get()
+                pass
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def is_ready(self, scale=2):
+        with self._lock:
+            return scale in self._models
+
+    def is_loading(self, scale=2):
+        with self._lock:
+            return scale in self._loading
+
+    def load_error(self, scale=2):
+        with self._lock:
+            return self._errors.get(scale)
+
+
+def available_memory():
+    """Return the free physical memory in bytes, or None if it cannot be determined."""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def model_scale(model):
+    return model.config.scale
+
+
+def bytes_per_input_pixel(model):
+    """Estimate the peak activation memory EDSR needs per input pixel."""
+    n_feats = getattr(model.config, "n_feats", 64)
+    scale = model_scale(model)
+    # A handful of feature maps live at input resolution inside the residual
+    # blocks, and the upsampler holds scale^2 times as many channels before
+    # the pixel shuffle. Everything is float32.
+    return 4 * n_feats * (6 + 2 * scale * scale)
+
+
+def auto_tile_size(model, overlap=DEFAULT_OVERLAP, memory_budget_mb=None):
+    """Pick the largest square tile whose padded window fits in the memory budget."""
+    budget = (memory_budget_mb or DEFAULT_MEMORY_BUDGET_MB) * 1024 * 1024
+    free = available_memory()
+    if free is not None:
+        # Leave room for the output image and the rest of the application
+        budget = min(budget, free // 4)
+
+    window = int((budget / bytes_per_input_pixel(model)) ** 0.5)
+    return max(MIN_TILE_SIZE, window - 2 * overlap)
+
+
+def _split(length, tile_size):
+    """Return the (start, end) of each core tile along one axis."""
+    return [(start, min(start + tile_size, length)) for start in range(0, length, tile_size)]
+
+
+def _ramp(length, core_start, core_end, blend, scale):
+    """Return the output-space weights along one axis for a tile's kept region.
+
+    Neighbouring tiles ramp linearly across the same band around their shared
+    edge, so their weights always add up to exactly one.
+    """
+    keep_start = max(0, core_start - blend) if core_start > 0 else 0
+    keep_end = min(length, core_end + blend) if core_end < length else length
+
+    positions = np.arange(keep_start * scale, keep_end * scale, dtype=np.float32) + 0.5
+    weights = np.ones_like(positions)
+    width = 2 * blend * scale
+    if blend and core_start > 0:
+        rising = (positions - (core_start - blend) * scale) / width
+        weights = np.minimum(weights, rising)
+    if blend and core_end < length:
+        falling = ((core_end + blend) * scale - positions) / width
+        weights = np.minimum(weights, falling)
+    return keep_start, keep_end, np.clip(weights, 0.0, 1.0)
+
+
+def _run_window(model, rgb_array, top, bottom, left, right):
+    """Run the model on one window of an HxWx3 uint8 array and return HxWx3 floats."""
+    import torch
+
+    window = rgb_array[top:bottom, left:right].astype(np.float32) / 255.0
+    inputs = torch.from_numpy(np.ascontiguousarray(window.transpose(2, 0, 1))).unsqueeze(0)
+    with profiling.stage("tile", "tile", input_shape=list(inputs.shape)), torch.no_grad():
+        outputs = model(inputs)
+    return outputs.squeeze(0).permute(1, 2, 0).numpy()
+
+
+def _repeat_window(rgb_array, top, bottom, left, right, scale):
+    """Enlarge one window by pixel repetition, as a stand-in for tiles nobody will see."""
+    window = rgb_array[top:bottom, left:right].astype(np.float32) / 255.0
+    return np.repeat(np.repeat(window, scale, axis=0), scale, axis=1)
+
+
+def _foreground_box(foreground, top, bottom, left, right):
+    """Return the part of a region within FOREGROUND_MARGIN of the foreground, or None if there is none."""
+    near = foreground[max(0, top - FOREGROUND_MARGIN):bottom + FOREGROUND_MARGIN,
+                      max(0, left - FOREGROUND_MARGIN):right + FOREGROUND_MARGIN]
+    rows = np.flatnonzero(near.any(axis=1))
+    if not len(rows):
+        return None
+    columns = np.flatnonzero(near.any(axis=0))
+    # Back to image coordinates, grown by the margin and clamped to the region
+    origin_y = max(0, top - FOREGROUND_MARGIN)
+    origin_x = max(0, left - FOREGROUND_MARGIN)
+    return (max(top, origin_y + rows[0] - FOREGROUND_MARGIN),
+            min(bottom, origin_y + rows[-1] + 1 + FOREGROUND_MARGIN),
+            max(left, origin_x + columns[0] - FOREGROUND_MARGIN),
+            min(right, origin_x + columns[-1] + 1 + FOREGROUND_MARGIN))
+
+
+def _tile_threads(workers):
+    """Intra-op threads per tile worker, so that the workers together use each core once."""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def auto_workers():
+    """Pick how many tiles to run at once, giving each at least THREADS_PER_TILE_WORKER cores."""
+    return max(1, (os.cpu_count() or 1) // THREADS_PER_TILE_WORKER)
+
+
+def _ordered_map(fn, items, workers):
+    """Yield fn(item) for each item in order, computing up to 2 * workers items ahead on a thread pool.
+
+    The workers share the caller's objects, so the model weights are never copied. Each
+    worker runs torch with its share of the cores, and the caller's setting is restored after.
+    """
+    workers = min(workers, len(items))
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    import torch
+
+    previous_threads = torch.get_num_threads()
+    threads = _tile_threads(workers)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upscale-tile",
+                                  initializer=torch.set_num_threads, initargs=(threads,))
+    pending = deque()
+    remaining = iter(items)
+    try:
+        for item in itertools.islice(remaining, 2 * workers):
+            pending.append(executor.submit(fn, item))
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(remaining, 1):
+                pending.append(executor.submit(fn, item))
+            yield result
+    finally:
+        # Runs too when the caller stops early, e.g. because the job was cancelled
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        torch.set_num_threads(previous_threads)
+
+
+def upscale_array(rgb_array, model, tile_size=None, overlap=DEFAULT_OVERLAP, blend=DEFAULT_BLEND,
+                  memory_budget_mb=None, progress=None, foreground=None, workers=1):
+    """Upscale an HxWx3 uint8 array tile by tile and return the HxWx3 uint8 result.
+
+    Each core tile is run with `overlap` pixels of surrounding context, which is
+    cropped away again, and adjacent tiles are cross-faded over 2 * `blend`
+    pixels. Only one row of tiles is held in floating point at a time.
+    `progress`, if given, is called with the fraction of tiles finished.
+
+    With a `foreground` HxW boolean mask, only the part of each tile within
+    FOREGROUND_MARGIN pixels of the foreground goes through the model, still with
+    `overlap` pixels of context; the rest is enlarged by pixel repetition. Output
+    pixels near the foreground therefore match the result without a mask.
+
+    With `workers` > 1, that many tiles run through the model at once on a thread
+    pool sharing the one model, each with its share of the cores, and the memory
+    budget is split between them. Finished tiles are blended in their usual order,
+    so the result is identical to a single worker's. Models whose thread count the
+    workers cannot limit, such as ONNX exports, always run one tile at a time.
+    """
+    if not getattr(model, "parallel_tiles", True):
+        workers = 1
+    scale = model_scale(model)
+    height, width = rgb_array.shape[:2]
+    blend = min(blend, overlap)
+    if tile_size is None:
+        tile_size = auto_tile_size(model, overlap, (memory_budget_mb or DEFAULT_MEMORY_BUDGET_MB) / workers)
+    tile_size = max(tile_size, 2 * blend + 1)
+
+    output = np.empty((height * scale, width * scale, 3), dtype=np.uint8)
+    columns = [((x0, x1), _ramp(width, x0, x1, blend, scale)) for x0, x1 in _split(width, tile_size)]
+    rows = [((y0, y1), _ramp(height, y0, y1, blend, scale)) for y0, y1 in _split(height, tile_size)]
+    total_tiles = len(rows) * len(columns)
+
+    def run_tile(tile):
+        """Return the weighted contribution of one tile to its kept region."""
+        ((y0, y1), (keep_top, keep_bottom, y_weights)), ((x0, x1), (keep_left, keep_right, x_weights)) = tile
+        region = (keep_top, keep_bottom, keep_left, keep_right)
+        if foreground is not None:
+            region = _foreground_box(foreground, keep_top, keep_bottom, keep_left, keep_right)
+
+        if region is None:
+            kept = _repeat_window(rgb_array, keep_top, keep_bottom, keep_left, keep_right, scale)
+        elif region != (keep_top, keep_bottom, keep_left, keep_right):
+            # Only part of the tile is near the subject: run the model on that part, with
+            # the usual context around it, and fill the rest
+            kept = _repeat_window(rgb_array, keep_top, keep_bottom, keep_left, keep_right, scale)
+            box_top, box_bottom, box_left, box_right = region
+            top = max(0, box_top - overlap)
+            left = max(0, box_left - overlap)
+            result = _run_window(model, rgb_array, top, min(height, box_bottom + overlap),
+                                 left, min(width, box_right + overlap))
+            kept[(box_top - keep_top) * scale:(box_bottom - keep_top) * scale,
+                 (box_left - keep_left) * scale:(box_right - keep_left) * scale] = result[
+                (box_top - top) * scale:(box_bottom - top) * scale,
+                (box_left - left) * scale:(box_right - left) * scale]
+        else:
+            top = max(0, y0 - overlap)
+            left = max(0, x0 - overlap)
+            result = _run_window(model, rgb_array, top, min(height, y1 + overlap),
+                                 left, min(width, x1 + overlap))
+
+            # Crop the context away, keeping only the region this tile contributes to
+            kept = result[(keep_top - top) * scale:(keep_bottom - top) * scale,
+                          (keep_left - left) * scale:(keep_right - left) * scale]
+        return kept * (y_weights[:, None, None] * x_weights[None, :, None])
+
+    contributions = _ordered_map(run_tile, [(row, column) for row in rows for column in columns], workers)
+
+    try:
+        carry = None
+        for row_index, ((y0, y1), (keep_top, keep_bottom, _)) in enumerate(rows):
+            strip = np.zeros(((keep_bottom - keep_top) * scale, width * scale, 3), dtype=np.float32)
+            if carry is not None:
+                strip[:carry.shape[0]] += carry
+
+            for column_index, (_, (keep_left, keep_right, _)) in enumerate(columns):
+                strip[:, keep_left * scale:keep_right * scale] += next(contributions)
+
+                if progress:
+                    progress((row_index * len(columns) + column_index + 1) / total_tiles)
+
+            # Rows above the next tile row's blend band will not change again
+            last_row = row_index == len(rows) - 1
+            final_rows = strip.shape[0] if last_row else (y1 - blend - keep_top) * scale
+            output[keep_top * scale:keep_top * scale + final_rows] = np.clip(
+                np.rint(strip[:final_rows] * 255), 0, 255).astype(np.uint8)
+            carry = None if last_row else strip[final_rows:].copy()
+    finally:
+        # Stop the workers if a progress callback raised, e.g. to cancel the job
+        contributions.close()
+
+    return output
+
+
+def upscale(image, model, tile_size=None, overlap=DEFAULT_OVERLAP, blend=DEFAULT_BLEND, memory_budget_mb=None,
+            progress=None, disk_cache=None, skip_transparent=False, workers=1):
+    """Upscale a PIL image with an EDSR model, carrying the alpha channel along.
+
+    `progress`, if given, is called as progress(stage, fraction) for each stage in UPSCALE_STAGES.
+    With a disk_cache, an image upscaled before is read back instead of recomputed.
+    With skip_transparent, only tiles near pixels with alpha > 0 are run through the model;
+    the visible result is unchanged, only the color of fully transparent pixels differs.
+    With workers > 1, that many tiles are upscaled in parallel (see upscale_array).
+    """
+    if progress:
+        progress("decode", 0.0)
+
+    if disk_cache is not None:
+        from disk_cache import package_version
+
+        # Tiling reproduces the single-pass result, so the tile settings are not part of the key
+        params = {"scale": model_scale(model)}
+        if getattr(model, "variant", None):
+            params["variant"] = model.variant
+        if skip_transparent:
+            params["skip_transparent"] = True
+        key = disk_cache.key(image, getattr(model.config, "name_or_path", "") or "edsr",
+                             package_version("super-image"), params)
+        cached = disk_cache.get(key)
+        if cached is not None:
+            return cached
+
+        started = time.perf_counter()
+        upscaled_image = upscale(image, model, tile_size, overlap, blend, memory_budget_mb, progress,
+                                 skip_transparent=skip_transparent, workers=workers)
+        disk_cache.put(key, upscaled_image, time.perf_counter() - started)
+        return upscaled_image
+    # Note: The model is trained on RGB, so we convert before processing.
+    with profiling.stage("convert"):
+        rgb_array = np.asarray(image.convert("RGB"))
+
+    foreground = None
+    if skip_transparent and 'A' in image.getbands():
+        foreground = np.asarray(image.getchannel('A')) > 0
+        if foreground.all():
+            foreground = None
+        elif tile_size is None:
+            # The default tiles are too coarse to leave much of the background out
+            tile_size = min(FOREGROUND_TILE_SIZE, auto_tile_size(model, overlap, memory_budget_mb))
+
+    if progress:
+        progress("inference", 0.0)
+    tile_progress = (lambda fraction: progress("inference", fraction)) if progress else None
+    scale = model_scale(model)
+    with profiling.stage("inference", scale=scale, workers=workers, variant=getattr(model, "variant", None),
+                         input_shape=[1, 3, image.height, image.width],
+                         output_shape=[1, 3, image.height * scale, image.width * scale]):
+        upscaled_image = Image.fromarray(
+            upscale_array(rgb_array, model, tile_size, overlap, blend, memory_budget_mb, tile_progress, foreground,
+                          workers))
+
+    if progress:
+        progress("compositing", 0.0)
+
+    # Restore alpha channel from original image, if it existed
+    if 'A' in image.getbands():
+        with profiling.stage("alpha resize", size=list(upscaled_image.size)):
+            alpha_channel = image.getchannel('A')
+            upscaled_alpha = alpha_channel.resize(upscaled_image.size, Image.LANCZOS)
+            upscaled_image.putalpha(upscaled_alpha)
+
+    return upscaled_image
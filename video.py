@@ -0,0 +1,348 @@
+"""Background removal for videos and image sequences.
+
+Example:
+    python video.py turntable.mp4 -o turntable.webm
+    python video.py "frames/*.png" -o cutouts/ --change-threshold 0.01
+
+Frames are decoded, segmented and encoded by three stages running at the same time.
+A frame that differs from the last segmented frame by less than --change-threshold
+reuses its mask instead of running the network. Reading and writing video files
+needs PyAV (pip install av); image sequences need nothing extra.
+"""
+import argparse
+import glob
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageColor
+
+from batch import IMAGE_EXTENSIONS, apply_background_color
+from pipeline import cutout, segment
+from profiles import DEFAULT_PROFILE, PROFILES, new_session
+from sessions import DEFAULT_MODEL
+
+# Output containers that can carry an alpha channel, and how to encode them
+VIDEO_CODECS = {
+    ".webm": ("libvpx-vp9", "yuva420p"),
+    ".mov": ("prores_ks", "yuva444p10le"),
+    ".mkv": ("png", "rgba"),
+    # No alpha: frames are composited over the background color, black by default
+    ".mp4": ("libx264", "yuv420p"),
+}
+
+DEFAULT_FPS = 25
+
+# Frames are compared as small grayscale thumbnails of this size
+SIGNATURE_SIZE = (64, 64)
+
+# Mean absolute difference (0-1) below which a frame reuses the previous mask
+DEFAULT_CHANGE_THRESHOLD = 0.01
+
+# Most consecutive frames that may reuse one mask, so slow drift cannot accumulate
+DEFAULT_MAX_REUSE = 5
+
+# Frames buffered between stages
+DEFAULT_QUEUE_SIZE = 8
+
+_END = object()
+
+
+def _import_av():
+    try:
+        import av
+    except ImportError:
+        raise RuntimeError("Reading and writing video files needs PyAV: pip install av") from None
+    return av
+
+
+def is_video_path(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_CODECS or path.lower().endswith((".avi", ".m4v"))
+
+
+def collect_frames(pattern):
+    """Expand a directory or glob pattern into a sorted list of image files."""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def read_frames(source):
+    """Return (lazy iterator of RGB frames, frame rate or None) for a video file, directory or glob."""
+    if os.path.isfile(source) and is_video_path(source):
+        av = _import_av()
+        container = av.open(source)
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+
+        def frames():
+            try:
+                for frame in container.decode(stream):
+                    yield frame.to_image()
+            finally:
+                container.close()
+
+        return frames(), float(stream.average_rate) if stream.average_rate else None
+
+    paths = collect_frames(source)
+    if not paths:
+        raise FileNotFoundError(f"No frames found for {source}")
+    return (Image.open(path).convert("RGB") for path in paths), None
+
+
+class PngSequenceWriter:
+    """Writes frames as numbered PNG files in a directory."""
+
+    def __init__(self, directory, compress_level=1):
+        self.directory = directory
+        self.compress_level = compress_level
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, image):
+        self.count += 1
+        image.save(os.path.join(self.directory, f"frame_{self.count:06d}.png"), "PNG",
+                   compress_level=self.compress_level)
+
+    def close(self):
+        pass
+
+
+class VideoWriter:
+    """Encodes frames into a video file, keeping the alpha channel where the container allows it."""
+
+    def __init__(self, path, fps=DEFAULT_FPS):
+        self.av = _import_av()
+        self.codec, self.pix_fmt = VIDEO_CODECS[os.path.splitext(path)[1].lower()]
+        self.container = self.av.open(path, mode="w")
+        self.fps = fps
+        self.stream = None
+
+    @property
+    def has_alpha(self):
+        return self.pix_fmt.startswith(("yuva", "rgba"))
+
+    def write(self, image):
+        if self.stream is None:
+            from fractions import Fraction
+
+            self.stream = self.container.add_stream(self.codec, rate=Fraction(self.fps).limit_denominator(1001))
+            # Chroma subsampled formats need even dimensions
+            even = self.pix_fmt.endswith("420p")
+            self.stream.width = image.width - image.width % 2 if even else image.width
+            self.stream.height = image.height - image.height % 2 if even else image.height
+            self.stream.pix_fmt = self.pix_fmt
+        if image.size != (self.stream.width, self.stream.height):
+            image = image.crop((0, 0, self.stream.width, self.stream.height))
+        frame = self.av.VideoFrame.from_image(image if self.has_alpha else image.convert("RGB"))
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+
+    def close(self):
+        if self.stream is not None:
+            for packet in self.stream.encode():
+                self.container.mux(packet)
+        self.container.close()
+
+
+def open_writer(output, fps=DEFAULT_FPS):
+    """Return a VideoWriter for a video file name and a PngSequenceWriter for anything else."""
+    if os.path.splitext(output)[1].lower() in VIDEO_CODECS:
+        return VideoWriter(output, fps)
+    return PngSequenceWriter(output)
+
+
+def frame_signature(image):
+    """A small grayscale copy of a frame in [0, 1], cheap to compare against another frame."""
+    return np.asarray(image.convert("L").resize(SIGNATURE_SIZE, Image.BILINEAR), dtype=np.float32) / 255
+
+
+def _put(target, item, stop):
+    """Put an item on a bounded queue, giving up once another stage has failed."""
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(source, stop):
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def remove_video_background(frames, session, writer, alpha_matting=False, foreground_threshold=240,
+                            background_threshold=10, erode_size=10, background_color=None,
+                            change_threshold=DEFAULT_CHANGE_THRESHOLD, max_reuse=DEFAULT_MAX_REUSE,
+                            queue_size=DEFAULT_QUEUE_SIZE, progress=None):
+    """Remove the background from a stream of frames and hand the results to writer.write.
+
+    Decoding (iterating `frames`), segmentation and matting plus encoding run on three
+    threads connected by bounded queues. A frame whose signature differs from the last
+    segmented frame by less than change_threshold, and that follows fewer than max_reuse
+    reused frames, takes that frame's mask. `progress`, if given, is called with the
+    number of frames finished. Returns a dict of frame counts and per-stage seconds.
+    """
+    decoded = queue.Queue(maxsize=queue_size)
+    segmented = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    stats = {"frames": 0, "segmented": 0, "reused": 0, "decode": 0.0, "inference": 0.0, "encode": 0.0}
+
+    def decode():
+        try:
+            iterator = iter(frames)
+            while True:
+                started = time.perf_counter()
+                frame = next(iterator, _END)
+                stats["decode"] += time.perf_counter() - started
+                if frame is _END or not _put(decoded, frame, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(decoded, _END, stop)
+
+    def encode():
+        try:
+            while True:
+                item = _get(segmented, stop)
+                if item is _END:
+                    break
+                started = time.perf_counter()
+                frame, mask = item
+                image = cutout(frame, mask, alpha_matting, foreground_threshold, background_threshold, erode_size)
+                if background_color:
+                    image = apply_background_color(image, background_color)
+                writer.write(image)
+                stats["encode"] += time.perf_counter() - started
+                stats["frames"] += 1
+                if progress:
+                    progress(stats["frames"])
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=decode, name="video-decode", daemon=True),
+               threading.Thread(target=encode, name="video-encode", daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    started_at = time.perf_counter()
+    from rembg.bg import fix_image_orientation
+
+    key_signature = key_mask = None
+    reused_in_row = 0
+    try:
+        while True:
+            frame = _get(decoded, stop)
+            if frame is _END:
+                break
+            started = time.perf_counter()
+            # Orient every frame, not only those segmented, so reused masks line up with their frames
+            frame = fix_image_orientation(frame)
+            signature = frame_signature(frame)
+            reuse = (key_mask is not None and key_mask.size == frame.size and reused_in_row < max_reuse
+                     and float(np.abs(signature - key_signature).mean()) < change_threshold)
+            if reuse:
+                reused_in_row += 1
+                stats["reused"] += 1
+            else:
+                # Compare later frames with this one, not with their predecessor, so slow motion still counts
+                frame, masks = segment(frame, session)
+                key_signature, key_mask = signature, masks[0]
+                reused_in_row = 0
+                stats["segmented"] += 1
+            stats["inference"] += time.perf_counter() - started
+            if not _put(segmented, (frame, key_mask), stop):
+                break
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        _put(segmented, _END, stop)
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+    if errors:
+        raise errors[0]
+    stats["seconds"] = time.perf_counter() - started_at
+    stats["fps"] = stats["frames"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Remove the background from a video or an image sequence.")
+    parser.add_argument("input", help="video file, or a directory or glob pattern of frames")
+    parser.add_argument("-o", "--output", required=True,
+                        help="video file (.webm, .mov, .mkv keep alpha; .mp4 does not) or a directory for PNGs")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="rembg segmentation model")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="inference profile: float32 quality, thread-tuned balanced or int8 fast")
+    parser.add_argument("--alpha-matting", action="store_true", help="refine edges with alpha matting")
+    parser.add_argument("--foreground-threshold", type=int, default=240)
+    parser.add_argument("--background-threshold", type=int, default=10)
+    parser.add_argument("--erode-size", type=int, default=10)
+    parser.add_argument("--background-color", help="solid background color, e.g. '#ffffff' or 'white'")
+    parser.add_argument("--change-threshold", type=float, default=DEFAULT_CHANGE_THRESHOLD,
+                        help="mean frame difference (0-1) below which the previous mask is reused; 0 disables reuse")
+    parser.add_argument("--max-reuse", type=int, default=DEFAULT_MAX_REUSE,
+                        help="most consecutive frames that may reuse one mask")
+    parser.add_argument("--fps", type=float, help=f"output frame rate (default: the input's, or {DEFAULT_FPS})")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="frames buffered between stages")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    try:
+        frames, input_fps = read_frames(args.input)
+        writer = open_writer(args.output, args.fps or input_fps or DEFAULT_FPS)
+    except (OSError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    background_color = ImageColor.getrgb(args.background_color) if args.background_color else None
+    if isinstance(writer, VideoWriter) and not writer.has_alpha and background_color is None:
+        background_color = (0, 0, 0)
+
+    print("Loading model...")
+    session = new_session(args.model, args.profile)
+    stats = remove_video_background(
+        frames, session, writer,
+        alpha_matting=args.alpha_matting,
+        foreground_threshold=args.foreground_threshold,
+        background_threshold=args.background_threshold,
+        erode_size=args.erode_size,
+        background_color=background_color,
+        change_threshold=args.change_threshold,
+        max_reuse=max(0, args.max_reuse),
+        queue_size=max(1, args.queue_size),
+        progress=lambda count: print(f"\r{count} frame(s)", end="", flush=True)
+    )
+
+    print()
+    print(f"Wrote {stats['frames']} frame(s) to {args.output} in {stats['seconds']:.2f}s ({stats['fps']:.2f} fps)")
+    print(f"Segmented {stats['segmented']}, reused the previous mask for {stats['reused']}")
+    print("Busy time per stage (the stages overlap):")
+    for stage in ("decode", "inference", "encode"):
+        print(f"  {stage:<10} {stats[stage]:8.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())